@@ -0,0 +1,57 @@
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Prueba de carga sencilla para comparar la API antes/después de un cambio.
+# Uso: python bench_api.py --url http://localhost:8000 --concurrencia 50 --peticiones 2000
+
+RUTAS_DEFAULT = [
+    "/api/reporte-capacidad",
+    "/api/todos-los-pedidos?limit=1000",
+]
+
+def hacer_peticion(url: str, timeout: float):
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status < 400
+    except Exception:
+        ok = False
+    return time.perf_counter() - inicio, ok
+
+def percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+def medir_ruta(base: str, ruta: str, concurrencia: int, peticiones: int, timeout: float):
+    url = base.rstrip("/") + ruta
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        resultados = list(executor.map(lambda _: hacer_peticion(url, timeout), range(peticiones)))
+    total = time.perf_counter() - inicio
+
+    latencias = [seg * 1000 for seg, _ in resultados]
+    errores = sum(1 for _, ok in resultados if not ok)
+    print(f"{ruta}")
+    print(f"   {peticiones / total:,.1f} req/s | p50 {statistics.median(latencias):,.1f} ms | "
+          f"p99 {percentil(latencias, 99):,.1f} ms | errores {errores}/{peticiones}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de programación")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--ruta", action="append", help="Ruta a medir (se puede repetir)")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"--- PRUEBA DE CARGA: {args.url} ({args.concurrencia} clientes) ---")
+    for ruta in args.ruta or RUTAS_DEFAULT:
+        medir_ruta(args.url, ruta, args.concurrencia, args.peticiones, args.timeout)
+
+if __name__ == "__main__":
+    main()
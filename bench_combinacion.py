@@ -0,0 +1,73 @@
+import pandas as pd
+import numpy as np
+import logging
+import sys
+import time
+
+from etl import combinar_plancor_terminado
+
+# Benchmark y prueba diferencial de la combinación de la maestra con PLANCOR y TERMINADO.
+# Compara los dos pd.merge de antes contra etl.combinar_plancor_terminado (factorize + lookup)
+# y verifica que sin OPs repetidas el resultado sea idéntico renglón por renglón.
+# Uso: python bench_combinacion.py [num_ops]
+
+NUM_OPS_DEFAULT = 200000
+SEMILLA = 42
+
+def combinar_con_merge(df_master, df_plancor, df_terminado) -> pd.DataFrame:
+    """ La combinación tal como estaba antes. """
+    df = pd.merge(df_master, df_plancor, left_on='OP', right_on='op_plancor', how='left')
+    return pd.merge(df, df_terminado, left_on='OP', right_on='op_terminado', how='left')
+
+def generar_datos(num: int, repetidas: int = 0):
+    rng = np.random.default_rng(SEMILLA)
+    ops = np.array([str(100000 + i) for i in range(num)], dtype=object)
+    df_master = pd.DataFrame({
+        "OP": ops,
+        "CLIENTE": [f"CLIENTE {i % 500}" for i in range(num)],
+        "PIEZAS": rng.integers(100, 5000, num),
+        "M2": rng.uniform(100, 9000, num),
+    })
+    # Un poco más de la mitad de las OPs están en PLANCOR y un tercio en TERMINADO
+    en_plancor = rng.permutation(ops)[: int(num * 0.6)]
+    df_plancor = pd.DataFrame({
+        "op_plancor": en_plancor,
+        "cantidad_plancor": rng.integers(0, 5000, len(en_plancor)).astype(float),
+    })
+    if repetidas:
+        df_plancor = pd.concat([df_plancor, df_plancor.sample(repetidas, random_state=SEMILLA)], ignore_index=True)
+    df_terminado = pd.DataFrame({"op_terminado": rng.permutation(ops)[: num // 3]})
+    df_terminado['existe_en_terminado'] = True
+    return df_master, df_plancor, df_terminado
+
+def medir(nombre: str, funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    print(f"   {nombre:<34} {time.perf_counter() - inicio:8.3f} s ({len(resultado):,} renglones)")
+    return resultado
+
+def comparar(num: int):
+    print(f"--- {num:,} OPs sin repetidas ---")
+    df_master, df_plancor, df_terminado = generar_datos(num)
+    antes = medir("pd.merge x2", combinar_con_merge, df_master, df_plancor, df_terminado)
+    despues = medir("combinar_plancor_terminado", combinar_plancor_terminado, df_master, df_plancor, df_terminado)
+
+    iguales = (
+        len(antes) == len(despues)
+        and antes['OP'].tolist() == despues['OP'].tolist()
+        and antes['cantidad_plancor'].equals(despues['cantidad_plancor'])
+        and antes['existe_en_terminado'].notna().tolist() == despues['existe_en_terminado'].tolist()
+    )
+    print(f"   Resultado idéntico: {'SÍ' if iguales else 'NO'}")
+
+    repetidas = num // 100
+    print(f"--- {num:,} OPs con {repetidas:,} renglones repetidos en PLANCOR ---")
+    df_master, df_plancor, df_terminado = generar_datos(num, repetidas)
+    medir("pd.merge x2", combinar_con_merge, df_master, df_plancor, df_terminado)
+    medir("combinar_plancor_terminado", combinar_plancor_terminado, df_master, df_plancor, df_terminado)
+    return iguales
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_OPS_DEFAULT
+    sys.exit(0 if comparar(num) else 1)
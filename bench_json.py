@@ -0,0 +1,47 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from main import RespuestaJSON
+
+# Compara el CPU por petición de la serialización anterior (jsonable_encoder + JSONResponse)
+# contra RespuestaJSON (orjson), con documentos del mismo tamaño que los pedidos del ETL.
+# Uso: python bench_json.py --docs 1000 --repeticiones 50
+
+def generar_pedidos(num: int) -> list:
+    base = datetime(2025, 1, 6)
+    return [{
+        "OP": str(100000 + i), "CLIENTE": f"CLIENTE {i % 300}", "TIPO": "RSC", "MATERIAL": "KRAFT",
+        "FLAUTA": "C", "ANCHO": 40.5, "LARGO": 60.25, "OC": f"OC-{i}",
+        "FECHA_INGRESO": base + timedelta(days=i % 30), "PIEZAS": 1000 + i, "DIRECCION_ENTREGA": "PLANTA NORTE",
+        "FECHA_ENTREGA": base + timedelta(days=i % 30 + 5), "M2": 1234.5 + i, "ESTATUS_EXCEL": "SIN PROGRAMAR",
+        "prioridad": i % 3, "fecha_programacion_asignada": base + timedelta(days=i % 10), "fijo_usuario": False,
+    } for i in range(num)]
+
+def medir(nombre: str, serializar, docs: list, repeticiones: int) -> float:
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        cuerpo = serializar(docs)
+    ms = (time.process_time() - inicio) / repeticiones * 1000
+    print(f"   {nombre:<36} {ms:8.2f} ms CPU/petición ({len(cuerpo) / 1024:,.0f} KB)")
+    return ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de respuestas")
+    parser.add_argument("--docs", type=int, action="append", help="Documentos por respuesta (se puede repetir)")
+    parser.add_argument("--repeticiones", type=int, default=30)
+    args = parser.parse_args()
+
+    for num in args.docs or [1000, 10000]:
+        docs = generar_pedidos(num)
+        print(f"--- {num} pedidos ---")
+        antes = medir("jsonable_encoder + JSONResponse", lambda d: JSONResponse(content=jsonable_encoder(d)).body,
+                      docs, args.repeticiones)
+        despues = medir("RespuestaJSON", lambda d: RespuestaJSON(content=d).body, docs, args.repeticiones)
+        print(f"   Mejora: {antes / max(despues, 1e-9):.1f}x")
+
+if __name__ == "__main__":
+    main()
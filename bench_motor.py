@@ -0,0 +1,115 @@
+import pandas as pd
+import numpy as np
+import logging
+import time
+from datetime import datetime, timedelta
+
+import scheduler
+from scheduler import (
+    CalendarioLaboral, asignar_pedidos, calcular_dias_reporte, calcular_fecha_limite_entrega, obtener_proximo_dia_habil
+)
+
+# Benchmark y prueba diferencial del motor de programación.
+# Genera pedidos sintéticos, corre el motor por arreglos (scheduler.asignar_pedidos) y el
+# motor anterior (pedido por pedido con iterrows, con obtener_proximo_dia_habil y
+# calcular_fecha_limite_entrega día por día, sin CalendarioLaboral) y verifica que asignen
+# exactamente igual.
+# Uso: python bench_motor.py [num_pedidos]
+
+NUM_PEDIDOS_DEFAULT = 100000
+SEMILLA = 42
+
+def motor_referencia(df_pedidos, reglas_calendario, dias_reporte, fecha_posteriores, capacidad_usada_por_dia):
+    """ El motor tal como estaba antes: iterrows y día por día para cada pedido. """
+    actualizaciones_fechas = {}
+    dia_programacion_actual = dias_reporte[0]
+
+    while True:
+        if dia_programacion_actual == fecha_posteriores: break
+        usado = capacidad_usada_por_dia.get(dia_programacion_actual, 0)
+        if usado >= scheduler.UMBRAL_CIERRE_DIA:
+            nuevo_dia = obtener_proximo_dia_habil(dia_programacion_actual, reglas_calendario)
+            if nuevo_dia not in dias_reporte:
+                dia_programacion_actual = fecha_posteriores
+                break
+            dia_programacion_actual = nuevo_dia
+        else:
+            break
+
+    for _, pedido in df_pedidos.iterrows():
+        op = pedido['OP']
+        m2 = pedido['M2']
+        dia_a_probar = dia_programacion_actual
+
+        while True:
+            if dia_a_probar == fecha_posteriores:
+                dia_asignado = fecha_posteriores
+                break
+            regla_dia = reglas_calendario.get(dia_a_probar)
+            capacidad_dia = regla_dia[1] if regla_dia else scheduler.CAPACIDAD_DIARIA_DEFAULT
+            uso_actual_dia = capacidad_usada_por_dia.get(dia_a_probar, 0)
+            fecha_limite_ent = calcular_fecha_limite_entrega(dia_a_probar, reglas_calendario)
+            if pedido['FECHA_ENTREGA'].date() > fecha_limite_ent:
+                dia_a_probar = obtener_proximo_dia_habil(dia_a_probar, reglas_calendario)
+                if dia_a_probar not in dias_reporte: dia_a_probar = fecha_posteriores
+                continue
+            if (uso_actual_dia + m2) <= capacidad_dia:
+                dia_asignado = dia_a_probar
+                break
+            dia_a_probar = obtener_proximo_dia_habil(dia_a_probar, reglas_calendario)
+            if dia_a_probar not in dias_reporte: dia_a_probar = fecha_posteriores
+
+        actualizaciones_fechas[op] = dia_asignado
+        capacidad_usada_por_dia[dia_asignado] += m2
+
+        if dia_asignado == dia_programacion_actual and dia_asignado != fecha_posteriores:
+            if capacidad_usada_por_dia[dia_asignado] >= scheduler.UMBRAL_CIERRE_DIA:
+                nuevo_dia = obtener_proximo_dia_habil(dia_asignado, reglas_calendario)
+                if nuevo_dia in dias_reporte:
+                    dia_programacion_actual = nuevo_dia
+                else:
+                    dia_programacion_actual = fecha_posteriores
+
+    return actualizaciones_fechas
+
+def generar_pedidos(num_pedidos: int, hoy: datetime, rng) -> pd.DataFrame:
+    return pd.DataFrame({
+        "OP": [str(200000 + i) for i in range(num_pedidos)],
+        # Mezcla de pedidos chicos y algunos grandes, como en la maestra
+        "M2": np.round(rng.lognormal(mean=7.0, sigma=1.2, size=num_pedidos), 2),
+        "FECHA_ENTREGA": hoy + pd.to_timedelta(rng.integers(-5, 20, size=num_pedidos), unit='D'),
+    })
+
+def comparar(num_pedidos: int):
+    rng = np.random.default_rng(SEMILLA)
+    hoy = datetime.combine(datetime.now().date(), datetime.min.time())
+    reglas = {(hoy + timedelta(days=3)).date(): (False, 0.0), (hoy + timedelta(days=6)).date(): (True, 120000.0)}
+    calendario = CalendarioLaboral(reglas, hoy.date())
+    dias_reporte, fecha_posteriores = calcular_dias_reporte(calendario)
+
+    df_pedidos = generar_pedidos(num_pedidos, hoy, rng)
+    carga_inicial = {dia: float(rng.integers(0, 120000)) for dia in dias_reporte}
+    carga_inicial[fecha_posteriores] = 0.0
+
+    carga_ref = dict(carga_inicial)
+    inicio = time.perf_counter()
+    esperado = motor_referencia(df_pedidos, reglas, dias_reporte, fecha_posteriores, carga_ref)
+    seg_ref = time.perf_counter() - inicio
+
+    carga_nueva = dict(carga_inicial)
+    inicio = time.perf_counter()
+    obtenido = asignar_pedidos(df_pedidos, calendario, dias_reporte, fecha_posteriores, carga_nueva)
+    seg_nuevo = time.perf_counter() - inicio
+
+    iguales = esperado == obtenido and carga_ref == carga_nueva
+    print(f"--- MOTOR DE PROGRAMACIÓN: {num_pedidos:,} pedidos ---")
+    print(f"   Anterior (iterrows): {seg_ref:.2f} s")
+    print(f"   Por arreglos:        {seg_nuevo:.2f} s ({seg_ref / max(seg_nuevo, 1e-9):.0f}x)")
+    print(f"   Asignaciones idénticas: {'SÍ' if iguales else 'NO'}")
+    return iguales
+
+if __name__ == "__main__":
+    import sys
+    logging.disable(logging.INFO)
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PEDIDOS_DEFAULT
+    sys.exit(0 if comparar(num) else 1)
@@ -0,0 +1,73 @@
+from pymongo import MongoClient, UpdateOne
+import logging
+import re
+import unicodedata
+
+# Las claves de búsqueda las genera el ETL al cargar cada pedido (campo claves_busqueda)
+# y la API las consulta con un regex anclado (^texto), que sí puede usar el índice.
+# Se guardan todos los sufijos de OP y CLIENTE: así una búsqueda por "contiene"
+# se vuelve una búsqueda por prefijo sobre algún sufijo. Los pedidos que el ETL ya no
+# vuelve a escribir (fuera de la ventana, ya programados) las reciben de completar_claves_busqueda.
+# Uso: python busqueda.py (completa las claves que falten)
+
+# --- CONFIGURACIÓN ---
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = "produccion_db"
+LARGO_MIN_SUFIJO = 2    # Sufijos más cortos no aportan (casi todo coincide)
+TAMANO_LOTE_CLAVES = 5000   # Pedidos por bulk_write al completar claves
+
+def normalizar_texto(valor) -> str:
+    """ Minúsculas, sin acentos y con espacios simples. """
+    if valor is None:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(valor))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+def sufijos(texto: str) -> set:
+    """ Sufijos de al menos LARGO_MIN_SUFIJO caracteres (más el texto completo). """
+    if not texto:
+        return set()
+    return {texto[i:] for i in range(len(texto) - LARGO_MIN_SUFIJO + 1) if texto[i] != " "} | {texto}
+
+def claves_busqueda(op, cliente) -> list:
+    """ Todas las claves con las que se debe poder encontrar el pedido. """
+    return sorted(sufijos(normalizar_texto(op)) | sufijos(normalizar_texto(cliente)))
+
+def filtro_busqueda(texto: str) -> dict:
+    """ Filtro Mongo por prefijo sobre claves_busqueda (usa el índice multikey). """
+    # El espacio no necesita escape y así Mongo puede sacar el prefijo completo para el índice
+    prefijo = re.escape(normalizar_texto(texto)).replace("\\ ", " ")
+    return {"claves_busqueda": {"$regex": "^" + prefijo}}
+
+def completar_claves_busqueda(db, tamano_lote: int = TAMANO_LOTE_CLAVES) -> int:
+    """
+    Pone claves_busqueda a los pedidos que no la tienen (los cargados antes de que existiera
+    y que el ETL ya no reescribe). Idempotente: solo toca documentos sin el campo, así que se
+    puede llamar en cada arranque. Devuelve cuántos pedidos se completaron.
+    """
+    faltantes = {"claves_busqueda": {"$exists": False}}
+    completados = 0
+    operations = []
+    for doc in db.pedidos.find(faltantes, {"OP": 1, "CLIENTE": 1}):
+        # Si el ETL lo escribió en medio, sus claves se respetan
+        operations.append(UpdateOne(
+            {"_id": doc["_id"], **faltantes},
+            {"$set": {"claves_busqueda": claves_busqueda(doc.get("OP"), doc.get("CLIENTE"))}}
+        ))
+        if len(operations) >= tamano_lote:
+            completados += db.pedidos.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        completados += db.pedidos.bulk_write(operations, ordered=False).modified_count
+    if completados:
+        logging.info(f"Claves de búsqueda completadas en {completados} pedidos.")
+    return completados
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    client = MongoClient(MONGO_URI)
+    try:
+        completar_claves_busqueda(client[DB_NAME])
+    finally:
+        client.close()
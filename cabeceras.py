@@ -0,0 +1,189 @@
+from pyxlsb import open_workbook
+from datetime import datetime
+import json
+import logging
+import os
+import unicodedata
+
+from cache_excel import DIR_CACHE, clave_cache
+
+# Resolución de la cabecera de la MAESTRA: cada columna de COLUMNS_MAP se busca primero
+# por su nombre exacto y si no por su nombre normalizado (sin espacios de más, sin acentos,
+# sin distinguir mayúsculas), así 'M² INGRESADOS' o 'Direccion de entrega' siguen
+# encontrando su columna. La cabecera la lee el ETL en la misma pasada que los datos (el libro
+# se abre una vez) y se resuelve siempre; la caché guarda la última cabecera vista y las
+# huellas del libro (ruta, mtime y tamaño) ya reportadas: el drift respecto a la última
+# cabecera se reporta (como dict y en el log) una vez por versión del libro.
+# Uso: python debug.py (revisa la cabecera de la MAESTRA configurada en etl.py)
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_CACHE_CABECERAS = os.path.join(DIR_CACHE, "cabeceras.json")
+MAX_HUELLAS = 50    # Huellas que se conservan en la caché (las más recientes)
+
+
+def normalizar_nombre(nombre) -> str:
+    """ 'M² INGRESADOS ' -> 'm2 ingresados', 'DIRECCIÓN  DE ENTREGA' -> 'direccion de entrega'. """
+    if nombre is None:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(nombre))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split()).casefold()
+
+def leer_cabecera(ruta: str, hoja, fila_cabecera: int) -> list:
+    """ Nombres de la fila de cabecera (fila de Excel, base 1) en su posición; [] si no existe. """
+    idx_cabecera = fila_cabecera - 1
+    with open_workbook(ruta) as wb:
+        with wb.get_sheet(hoja) as sheet:
+            for row in sheet.rows(sparse=True):
+                if row[0].r == idx_cabecera:
+                    return [cell.v for cell in row]
+                if row[0].r > idx_cabecera:
+                    break
+    return []
+
+def resolver_columnas(cabecera: list, requeridas) -> tuple[dict, dict]:
+    """
+    Índice de cada columna requerida dentro de `cabecera` (exacto primero, luego normalizado).
+    Devuelve (indices, diferencias) con las faltantes, las que solo se encontraron por nombre
+    normalizado y las que tienen más de un candidato.
+    """
+    por_normalizado = {}
+    for i, nombre in enumerate(cabecera):
+        if nombre is not None:
+            por_normalizado.setdefault(normalizar_nombre(nombre), []).append(i)
+
+    indices = {}
+    diferencias = {"faltantes": [], "renombradas": [], "ambiguas": []}
+    for nombre in requeridas:
+        if nombre in cabecera:
+            indices[nombre] = cabecera.index(nombre)
+            continue
+        candidatos = por_normalizado.get(normalizar_nombre(nombre), [])
+        if not candidatos:
+            diferencias["faltantes"].append(nombre)
+            continue
+        indices[nombre] = candidatos[0]
+        diferencias["renombradas"].append(
+            {"esperada": nombre, "encontrada": cabecera[candidatos[0]], "indice": candidatos[0]}
+        )
+        if len(candidatos) > 1:
+            diferencias["ambiguas"].append({"columna": nombre, "indices": candidatos})
+    return indices, diferencias
+
+def comparar_con_anterior(cabecera: list, indices: dict, anterior: dict | None) -> dict:
+    """ Columnas movidas, agregadas y eliminadas respecto a la última cabecera vista del libro. """
+    if not anterior:
+        return {"movidas": [], "agregadas": [], "eliminadas": []}
+    indices_previos = anterior.get("indices", {})
+    # Agregadas/eliminadas por nombre normalizado: un espacio o acento de más no es columna nueva
+    previas = {normalizar_nombre(nombre) for nombre in anterior.get("cabecera", []) if nombre is not None}
+    actuales = {normalizar_nombre(nombre) for nombre in cabecera if nombre is not None}
+    return {
+        "movidas": [
+            {"columna": nombre, "antes": indices_previos[nombre], "ahora": idx}
+            for nombre, idx in indices.items()
+            if nombre in indices_previos and indices_previos[nombre] != idx
+        ],
+        "agregadas": [nombre for nombre in cabecera if nombre is not None and normalizar_nombre(nombre) not in previas],
+        "eliminadas": [
+            nombre for nombre in anterior.get("cabecera", [])
+            if nombre is not None and normalizar_nombre(nombre) not in actuales
+        ],
+    }
+
+def hay_drift(reporte: dict) -> bool:
+    return any(reporte[campo] for campo in ("faltantes", "renombradas", "ambiguas", "movidas", "agregadas", "eliminadas"))
+
+def registrar_drift(reporte: dict):
+    """ Log del reporte: error si faltan columnas, warning por cualquier otro cambio. """
+    libro = os.path.basename(reporte["ruta"])
+    if reporte["faltantes"]:
+        logging.error(f"{libro}: faltan columnas en la cabecera: {reporte['faltantes']}")
+    for r in reporte["renombradas"]:
+        logging.warning(f"{libro}: '{r['esperada']}' se encontró como '{r['encontrada']}' (columna {r['indice']})")
+    for a in reporte["ambiguas"]:
+        logging.warning(f"{libro}: '{a['columna']}' coincide con varias columnas {a['indices']}, se usa la primera")
+    for m in reporte["movidas"]:
+        logging.warning(f"{libro}: '{m['columna']}' se movió de la columna {m['antes']} a la {m['ahora']}")
+    if reporte["agregadas"]:
+        logging.warning(f"{libro}: columnas nuevas en la cabecera: {reporte['agregadas']}")
+    if reporte["eliminadas"]:
+        logging.warning(f"{libro}: columnas que ya no están en la cabecera: {reporte['eliminadas']}")
+
+# --- CACHÉ ---
+def cargar_cache() -> dict:
+    try:
+        with open(ARCHIVO_CACHE_CABECERAS, encoding="utf-8") as f:
+            cache = json.load(f)
+        if isinstance(cache, dict):
+            return {"huellas": cache.get("huellas", {}), "ultimas": cache.get("ultimas", {})}
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.warning(f"Caché de cabeceras dañada, se vuelve a resolver: {e}")
+    return {"huellas": {}, "ultimas": {}}
+
+def guardar_cache(cache: dict):
+    # Solo las huellas más recientes
+    recientes = sorted(cache["huellas"].items(), key=lambda item: item[1]["resuelto"], reverse=True)
+    cache["huellas"] = dict(recientes[:MAX_HUELLAS])
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    temporal = ARCHIVO_CACHE_CABECERAS + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, default=str)
+    os.replace(temporal, ARCHIVO_CACHE_CABECERAS)
+
+def llave_libro(ruta: str, hoja, fila_cabecera: int) -> str:
+    return f"{os.path.abspath(ruta)}|{hoja}|{fila_cabecera}"
+
+def reporte_cabecera(ruta: str, hoja, fila_cabecera: int, cabecera: list, requeridas, cache: dict) -> dict:
+    """
+    Resuelve las columnas requeridas en una cabecera ya leída y devuelve el reporte completo:
+    columnas (nombre -> índice), cabecera y el drift (faltantes, renombradas, ambiguas,
+    movidas, agregadas, eliminadas) contra la última cabecera vista del libro.
+    """
+    indices, diferencias = resolver_columnas(cabecera, requeridas)
+    anterior = cache["ultimas"].get(llave_libro(ruta, hoja, fila_cabecera))
+    return {
+        "ruta": ruta,
+        "hoja": hoja,
+        "fila_cabecera": fila_cabecera,
+        "columnas": indices,
+        "cabecera": cabecera,
+        **diferencias,
+        **comparar_con_anterior(cabecera, indices, anterior),
+    }
+
+def revisar_cabecera(ruta: str, hoja, fila_cabecera: int, requeridas, cache: dict | None = None) -> dict:
+    """ Lee la cabecera del libro y arma su reporte_cabecera. """
+    cache = cargar_cache() if cache is None else cache
+    return reporte_cabecera(ruta, hoja, fila_cabecera, leer_cabecera(ruta, hoja, fila_cabecera), requeridas, cache)
+
+def indices_columnas(ruta: str, hoja, fila_cabecera: int, cabecera: list, requeridas) -> dict:
+    """
+    Nombre requerido -> índice de columna en `cabecera` (la lee quien ya tiene el libro abierto).
+    La caché no evita la resolución, solo el reporte: el drift se registra la primera vez que
+    se ve una huella del libro. Las columnas faltantes no vienen en el dict.
+    """
+    requeridas = list(requeridas)
+    cache = cargar_cache()
+    reporte = reporte_cabecera(ruta, hoja, fila_cabecera, cabecera, requeridas, cache)
+    try:
+        huella = clave_cache(ruta, hoja=hoja, fila_cabecera=fila_cabecera, columnas=requeridas)
+    except OSError:
+        huella = None
+    if huella in cache["huellas"]:
+        return reporte["columnas"]
+
+    if hay_drift(reporte):
+        registrar_drift(reporte)
+    if huella is not None:
+        try:
+            cache["huellas"][huella] = {"resuelto": datetime.now().isoformat()}
+            cache["ultimas"][llave_libro(ruta, hoja, fila_cabecera)] = {
+                "cabecera": reporte["cabecera"], "indices": reporte["columnas"]
+            }
+            guardar_cache(cache)
+        except Exception as e:
+            logging.warning(f"No se pudo escribir la caché de cabeceras: {e}")
+    return reporte["columnas"]
@@ -0,0 +1,114 @@
+import pandas as pd
+import hashlib
+import json
+import logging
+import os
+
+# pyarrow es opcional: sin él los extractores leen el Excel como siempre
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# --- CONFIGURACIÓN ---
+# Carpeta local donde se guardan los DataFrames ya parseados (formato Arrow IPC)
+DIR_CACHE = os.environ.get(
+    "ETL_DIR_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_excel")
+)
+# Al pasar este tamaño se borran primero los archivos usados hace más tiempo
+TAMANO_MAX_CACHE_MB = 512
+# Entra en la clave: subirla cuando cambie cómo se leen/limpian los Excel o los dtypes
+# que se guardan, así las entradas viejas dejan de usarse aunque el archivo no haya cambiado
+VERSION_CACHE = 1
+
+
+def clave_cache(ruta: str, **parametros) -> str:
+    """ Clave del archivo de caché: ruta, mtime y tamaño del Excel + parámetros de lectura + VERSION_CACHE. """
+    st = os.stat(ruta)
+    datos = {
+        "version": VERSION_CACHE,
+        "ruta": os.path.abspath(ruta),
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+        **parametros
+    }
+    return hashlib.sha1(json.dumps(datos, sort_keys=True, default=str).encode()).hexdigest()
+
+def leer_desde_cache(archivo: str) -> pd.DataFrame:
+    """ Abre el archivo Arrow con memory-map (sin copiar las columnas numéricas). """
+    fuente = pa.memory_map(archivo)
+    tabla = pa.ipc.open_file(fuente).read_all()
+    # Marcamos el uso para que la limpieza borre primero lo que no se usa
+    os.utime(archivo)
+    return tabla.to_pandas()
+
+def guardar_en_cache(df: pd.DataFrame, archivo: str):
+    try:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # Columnas con tipos mezclados: no se cachean, se vuelven a leer la próxima vez
+        logging.warning(f"No se pudo cachear {os.path.basename(archivo)}: {e}")
+        return
+
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    temporal = archivo + ".tmp"
+    with pa.OSFile(temporal, "wb") as destino:
+        with pa.ipc.new_file(destino, tabla.schema) as writer:
+            writer.write_table(tabla)
+    os.replace(temporal, archivo)
+
+def limpiar_cache(tamano_max_mb: float = TAMANO_MAX_CACHE_MB):
+    """ Borra los archivos menos usados hasta quedar por debajo del tamaño máximo. """
+    if not os.path.isdir(DIR_CACHE):
+        return
+    archivos = []
+    for nombre in os.listdir(DIR_CACHE):
+        if nombre.endswith(".arrow"):
+            ruta = os.path.join(DIR_CACHE, nombre)
+            st = os.stat(ruta)
+            archivos.append((st.st_mtime, st.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in archivos)
+    limite = tamano_max_mb * 1024 * 1024
+    for _, tamano, ruta in sorted(archivos):
+        if total <= limite:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+            logging.info(f"Caché: eliminado {os.path.basename(ruta)} ({tamano / 1024 / 1024:.1f} MB)")
+        except OSError as e:
+            # En Windows un archivo todavía mapeado no se puede borrar
+            logging.warning(f"Caché: no se pudo eliminar {ruta}: {e}")
+
+def leer_con_cache(ruta: str, lector, **parametros) -> pd.DataFrame:
+    """
+    Devuelve el DataFrame de `lector()` usando la caché local si el Excel no cambió
+    (misma ruta, mtime, tamaño y parámetros de lectura). Si pyarrow no está
+    instalado o la caché falla, simplemente llama a `lector()`.
+    """
+    if pa is None:
+        return lector()
+    try:
+        clave = clave_cache(ruta, **parametros)
+    except OSError:
+        # Que el lector reporte el error real del archivo
+        return lector()
+
+    archivo = os.path.join(DIR_CACHE, f"{clave}.arrow")
+    if os.path.exists(archivo):
+        try:
+            df = leer_desde_cache(archivo)
+            logging.info(f"Caché: {os.path.basename(ruta)} sin cambios, leído desde {archivo}")
+            return df
+        except Exception as e:
+            logging.warning(f"Caché dañada para {ruta}, se vuelve a leer el Excel: {e}")
+
+    df = lector()
+    try:
+        guardar_en_cache(df, archivo)
+        limpiar_cache()
+    except Exception as e:
+        logging.warning(f"No se pudo escribir la caché de {ruta}: {e}")
+    return df
@@ -0,0 +1,183 @@
+from pymongo import MongoClient, UpdateOne
+from datetime import datetime, date
+import argparse
+import logging
+import math
+
+# Contadores de capacidad por día (un documento por fecha en reporte_capacidad_diaria).
+# Quien cambia fecha_programacion_asignada o M2 de un pedido (ETL, scheduler, swaps)
+# manda el $inc correspondiente justo después de su bulk_write sobre pedidos, así el
+# reporte nunca se recalcula sobre los pedidos. reconciliar() compara contra la suma
+# real y repara lo que se haya desviado: scheduler.main() la corre en cada ejecución, el
+# servicio de eventos cada INTERVALO_RECONCILIACION_S y se puede correr a mano con
+# python contadores.py. migrar_contadores() hace la primera reconciliación al desplegar
+# (antes los documentos del reporte eran una foto, con los días lejanos juntos en "Posteriores").
+
+# --- CONFIGURACIÓN ---
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = "produccion_db"
+COLECCION_CONTADORES = "reporte_capacidad_diaria"
+# Versión de los datos: la suben el ETL, el scheduler, los swaps y la reconciliación;
+# la API la usa para saber cuándo descartar su caché de respuestas.
+COLECCION_METADATOS = "metadatos"
+ID_VERSION_DATOS = "version_datos"
+ID_MIGRACION_CONTADORES = "contadores_migrados"
+CAPACIDAD_DIARIA_DEFAULT = 180000.00
+TOLERANCIA_M2 = 0.01    # Diferencias menores son redondeo de punto flotante
+
+
+def fecha_contador(fecha):
+    """ Llave del contador: la fecha a medianoche (None si el pedido no está programado). """
+    if isinstance(fecha, datetime):
+        return datetime.combine(fecha.date(), datetime.min.time())
+    if isinstance(fecha, date):
+        return datetime.combine(fecha, datetime.min.time())
+    return None
+
+def valor_m2(valor) -> float:
+    """ M2 tal como lo suma Mongo con $sum: lo que no es número cuenta como 0. """
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return 0.0
+    return 0.0 if math.isnan(valor) else float(valor)
+
+def sumar_delta(deltas: dict, fecha, m2, conteo: int = 0):
+    """ Acumula en `deltas` (fecha -> [m2, conteo]) el cambio de un día; sin fecha no hace nada. """
+    llave = fecha_contador(fecha)
+    if llave is None:
+        return
+    acumulado = deltas.setdefault(llave, [0.0, 0])
+    acumulado[0] += valor_m2(m2)
+    acumulado[1] += conteo
+
+def registrar_cambio(deltas: dict, fecha_antes, m2_antes, fecha_despues, m2_despues):
+    """ Un pedido pasa de (fecha_antes, m2_antes) a (fecha_despues, m2_despues). """
+    sumar_delta(deltas, fecha_antes, -valor_m2(m2_antes), -1)
+    sumar_delta(deltas, fecha_despues, m2_despues, 1)
+
+def operaciones_contadores(deltas: dict) -> list:
+    """
+    Un $inc por día con cambio. Si el día no existe se crea con la capacidad default
+    (la reconciliación le pone la del calendario).
+    """
+    operations = []
+    for fecha, (m2, conteo) in sorted(deltas.items()):
+        if abs(m2) < TOLERANCIA_M2 and conteo == 0:
+            continue
+        operations.append(UpdateOne({"fecha": fecha}, actualizacion_delta(m2, conteo), upsert=True))
+    return operations
+
+def actualizacion_delta(m2: float, conteo: int) -> dict:
+    return {"$inc": {"m2_utilizados": m2, "conteo_pedidos": conteo},
+            "$setOnInsert": {"capacidad_total_m2": CAPACIDAD_DIARIA_DEFAULT}}
+
+def aplicar_deltas(db, deltas: dict):
+    operations = operaciones_contadores(deltas)
+    if operations:
+        db[COLECCION_CONTADORES].bulk_write(operations, ordered=False)
+
+def marcar_datos_actualizados(db):
+    db[COLECCION_METADATOS].update_one(
+        {"_id": ID_VERSION_DATOS},
+        {"$inc": {"version": 1}, "$set": {"actualizado": datetime.now()}},
+        upsert=True
+    )
+
+# --- RECONCILIACIÓN ---
+def carga_real_por_dia(db) -> dict:
+    """ Suma real de M2 y conteo por día sobre los pedidos programados (índice parcial programados_m2). """
+    fecha = "$fecha_programacion_asignada"
+    pipeline = [
+        {"$match": {"fecha_programacion_asignada": {"$type": "date"}}},
+        {"$group": {
+            "_id": {"$dateFromParts": {"year": {"$year": fecha}, "month": {"$month": fecha}, "day": {"$dayOfMonth": fecha}}},
+            "total_m2": {"$sum": "$M2"},
+            "conteo": {"$sum": 1}
+        }}
+    ]
+    return {doc["_id"]: (doc["total_m2"], doc["conteo"]) for doc in db.pedidos.aggregate(pipeline)}
+
+def capacidades_calendario(db) -> dict:
+    capacidades = {}
+    for doc in db.calendario.find({}, {"fecha": 1, "capacidad_m2": 1}):
+        llave = fecha_contador(doc.get("fecha"))
+        if llave is not None:
+            capacidades[llave] = float(doc.get("capacidad_m2", CAPACIDAD_DIARIA_DEFAULT))
+    return capacidades
+
+def reconciliar(db, reparar: bool = True) -> list:
+    """
+    Compara cada contador contra la suma real de los pedidos y devuelve las diferencias
+    (fecha, m2/conteo del contador y reales). Con reparar=True las corrige con $set,
+    junto con la capacidad del calendario.
+    """
+    reales = carga_real_por_dia(db)
+    capacidades = capacidades_calendario(db)
+    contadores = {
+        doc["fecha"]: doc
+        for doc in db[COLECCION_CONTADORES].find({}, {"_id": 0})
+        if isinstance(doc.get("fecha"), datetime)
+    }
+
+    diferencias = []
+    operations = []
+    for fecha in sorted(set(reales) | set(contadores)):
+        m2_real, conteo_real = reales.get(fecha, (0.0, 0))
+        doc = contadores.get(fecha, {})
+        m2_contador = doc.get("m2_utilizados", 0.0)
+        conteo_contador = doc.get("conteo_pedidos", 0)
+        capacidad = capacidades.get(fecha, doc.get("capacidad_total_m2", CAPACIDAD_DIARIA_DEFAULT))
+
+        desviado = abs(m2_contador - m2_real) >= TOLERANCIA_M2 or conteo_contador != conteo_real
+        if desviado:
+            diferencias.append({
+                "fecha": fecha,
+                "m2_contador": m2_contador, "m2_real": m2_real,
+                "conteo_contador": conteo_contador, "conteo_real": conteo_real,
+            })
+        if desviado or doc.get("capacidad_total_m2") != capacidad:
+            operations.append(UpdateOne(
+                {"fecha": fecha},
+                {"$set": {"capacidad_total_m2": capacidad, "m2_utilizados": m2_real, "conteo_pedidos": conteo_real}},
+                upsert=True
+            ))
+
+    for d in diferencias:
+        logging.warning(
+            f"Contador desviado {d['fecha'].date()}: {d['m2_contador']:,.2f} m² / {d['conteo_contador']} pedidos "
+            f"(real {d['m2_real']:,.2f} m² / {d['conteo_real']} pedidos)"
+        )
+    if reparar and operations:
+        db[COLECCION_CONTADORES].bulk_write(operations, ordered=False)
+        marcar_datos_actualizados(db)
+        logging.info(f"Contadores reparados: {len(operations)} días.")
+    elif not diferencias:
+        logging.info("Contadores de capacidad al día, sin desviaciones.")
+    return diferencias
+
+def migrar_contadores(db) -> bool:
+    """
+    Reconciliación inicial, una sola vez por base de datos: los documentos que dejó el
+    reporte anterior (foto del horizonte con "Posteriores" acumulado) no sirven como base
+    de los $inc. La API, el scheduler y el servicio la llaman al arrancar; si dos procesos
+    la corren a la vez no pasa nada (reconciliar solo pone los valores reales).
+    """
+    if db[COLECCION_METADATOS].find_one({"_id": ID_MIGRACION_CONTADORES}):
+        return False
+    logging.info("Primera reconciliación de los contadores de capacidad (migración)...")
+    reconciliar(db, reparar=True)
+    db[COLECCION_METADATOS].update_one(
+        {"_id": ID_MIGRACION_CONTADORES}, {"$set": {"fecha": datetime.now()}}, upsert=True
+    )
+    return True
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Reconciliación de los contadores de capacidad por día")
+    parser.add_argument("--solo-revisar", action="store_true", help="Solo reporta las diferencias, no las corrige")
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    try:
+        reconciliar(client[DB_NAME], reparar=not args.solo_revisar)
+    finally:
+        client.close()
@@ -1,44 +1,28 @@
-import pandas as pd
+import json
 import logging
 
-# --- AJUSTA LA RUTA SI ES NECESARIO ---
-PATH_BASE = r"U:"
-# CAMBIO 1: Actualizamos la extensión a .xlsb
-FILE_MASTER_LIST = fr"{PATH_BASE}\COMPROBACION ERRORES BUENO.xlsb"
-SHEET_MASTER_LIST = "INGRESO DE ORDENES"
+from cabeceras import cargar_cache, hay_drift, registrar_drift, revisar_cabecera
+from etl import COLUMNS_MAP, FILA_CABECERA_EXCEL, FILE_MASTER_LIST, SHEET_MASTER_LIST
 
-logging.basicConfig(level=logging.INFO)
+# Revisa la cabecera de la MAESTRA contra COLUMNS_MAP (mismos archivo, hoja y fila que etl.py)
+# y muestra el reporte de drift: qué columna de Excel le toca a cada campo, cuáles faltan,
+# cuáles solo se encontraron por nombre normalizado y qué cambió desde la última cabecera vista.
+# Uso: python debug.py
 
-def debug_headers():
-    logging.info(f"--- LEYENDO: {FILE_MASTER_LIST} ---")
+def debug_headers() -> dict | None:
+    logging.info(f"--- LEYENDO CABECERA: {FILE_MASTER_LIST} (fila {FILA_CABECERA_EXCEL}) ---")
     try:
-        # Leemos SOLO la fila de encabezados (Fila 3 de Excel = índice 2 en Pandas)
-        # nrows=0 lee solo las columnas sin datos
-        
-        # CAMBIO 2: Usamos engine='pyxlsb' para archivos binarios
-        df = pd.read_excel(
-            FILE_MASTER_LIST,
-            sheet_name=SHEET_MASTER_LIST,
-            engine='pyxlsb',   # IMPORTANTE: openpyxl no lee .xlsb
-            header=2,          # Fila 3 de Excel
-            nrows=0            # No traer datos, solo columnas
-        )
-        
-        columnas = list(df.columns)
-        
-        # Guardamos en un archivo de texto para que lo puedas leer con calma
-        with open("columnas_detectadas.txt", "w", encoding="utf-8") as f:
-            f.write(f"ARCHIVO: {FILE_MASTER_LIST}\n")
-            f.write(f"Total columnas detectadas: {len(columnas)}\n")
-            f.write("-" * 40 + "\n")
-            for i, col in enumerate(columnas):
-                f.write(f"[{i}] '{col}'\n")
-                
-        logging.info(f"¡ÉXITO! Se detectaron {len(columnas)} columnas.")
-        logging.info(f"Abre el archivo 'columnas_detectadas.txt' para ver los nombres exactos.")
-        
+        reporte = revisar_cabecera(FILE_MASTER_LIST, SHEET_MASTER_LIST, FILA_CABECERA_EXCEL, COLUMNS_MAP, cargar_cache())
     except Exception as e:
         logging.error(f"Error leyendo el archivo: {e}")
+        return None
+
+    print(json.dumps(reporte, ensure_ascii=False, indent=2, default=str))
+    if hay_drift(reporte):
+        registrar_drift(reporte)
+    else:
+        logging.info(f"Cabecera sin cambios: las {len(reporte['columnas'])} columnas de COLUMNS_MAP encontradas.")
+    return reporte
 
 if __name__ == "__main__":
-    debug_headers()
\ No newline at end of file
+    debug_headers()
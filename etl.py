@@ -1,8 +1,22 @@
 import pandas as pd
 import numpy as np
+import argparse
 import logging
-from datetime import datetime
+import time
+from collections import deque
+from itertools import chain
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from pyxlsb import open_workbook
+
+from busqueda import claves_busqueda, completar_claves_busqueda
+from cabeceras import indices_columnas
+from cache_excel import leer_con_cache
+from contadores import COLECCION_METADATOS, aplicar_deltas, marcar_datos_actualizados, registrar_cambio
+from indices import asegurar_indices
 
 # --- CONFIGURACIÓN ---
 MONGO_URI = "mongodb://localhost:27017/"
@@ -21,9 +35,21 @@ SHEET_TERMINADO = 0
 
 # --- RANGO DE LECTURA ---
 FILA_CABECERA_EXCEL = 3 
+# Ventana fija: solo se usa con VENTANA_AUTOMATICA = False
 FILA_INICIO_DATOS = 174000 
 FILA_FIN_DATOS = 190000
 
+# --- VENTANA AUTOMÁTICA ---
+# La ventana va de la primera fila con Ingreso dentro de los últimos DIAS_HISTORIA días
+# (más FILAS_TRASLAPE filas antes, por si editaron pedidos viejos) a la última fila con OP.
+# La fila donde empezó la ventana se guarda en metadatos; la siguiente corrida empieza a
+# leer ahí (menos el traslape) en lugar de recorrer la hoja desde la cabecera.
+# Ejecutar con --escaneo-completo para ignorar la marca y buscar desde la cabecera.
+VENTANA_AUTOMATICA = True
+DIAS_HISTORIA = 120
+FILAS_TRASLAPE = 2000
+ID_MARCA_MAESTRA = "etl_marca_maestra"
+
 # --- MAPEO DE COLUMNAS ---
 # Eliminé TRANSPORTE como pediste.
 COLUMNS_MAP = {
@@ -44,6 +70,63 @@ COLUMNS_MAP = {
 
 CLIENTES_EXCLUIDOS = ['PYCAPSA TRIM', 'BOX NOW', 'MUESTRAS']
 
+# --- MODO INCREMENTAL ---
+# Se guarda un hash de contenido por OP para solo mandar a Mongo lo nuevo o modificado.
+# Ejecutar con --completo para forzar la recarga de todos los pedidos.
+MODO_INCREMENTAL = True
+COLECCION_HASHES = "etl_hash_pedidos"
+# Subir este número cuando cambie la forma del documento que escribe load() o los tipos
+# sobre los que se calcula el hash: invalida los hashes
+VERSION_DOCUMENTO = 3
+
+# --- ESQUEMA DE TIPOS ---
+# Tipos de cada columna del DataFrame de pedidos a lo largo del pipeline. Los textos con
+# muchas repeticiones van como category desde la lectura de la MAESTRA; OP y OC se quedan
+# como object (OP es única y OC mezcla números y texto). M2 se queda en float64: en float32
+# cambiaría el valor que se escribe en Mongo y las sumas de los contadores de capacidad.
+# Los NaN/NaT se quedan en el DataFrame y pasan a None hasta construir_operaciones.
+ESQUEMA_PEDIDOS = {
+    "OP": "object",
+    "CLIENTE": "category",
+    "TIPO": "category",
+    "MATERIAL": "category",
+    "FLAUTA": "category",
+    "ANCHO": "int32",
+    "LARGO": "int32",
+    "OC": "object",
+    "FECHA_INGRESO": "datetime64[ns]",
+    "PIEZAS": "int32",
+    "DIRECCION_ENTREGA": "category",
+    "FECHA_ENTREGA": "datetime64[ns]",
+    "M2": "float64",
+    "ESTATUS_EXCEL": "category",
+}
+ESTATUS_POSIBLES = ["SIN FABRICAR", "SIN PROGRAMAR", "INGRESADO SIN PROGRAMAR", "PROGRAMADO PARCIAL", "PROGRAMADO", "ERROR"]
+COLUMNAS_CATEGORICAS = {col for col, tipo in ESQUEMA_PEDIDOS.items() if tipo == "category"}
+
+# Registra en el log la memoria (deep) de los DataFrames en cada etapa
+PERFILAR_MEMORIA = True
+
+# --- CARGA A MONGO ---
+TAMANO_LOTE_CARGA = 2000   # Operaciones por bulk_write
+HILOS_CARGA = 1            # >1 manda los lotes en paralelo
+
+# --- COMBINACIÓN CON PLANCOR ---
+# Si una OP aparece varias veces en PEDIDOS.xlsx sus cantidades se combinan con esta
+# política ("sum" o "max") en lugar de duplicar el renglón de la maestra
+POLITICA_PLANCOR = "sum"
+
+# --- BACKFILL ---
+# Recorre la hoja completa (o el rango que se indique) en bloques de filas:
+# extract -> transform -> load por bloque, con checkpoint de la última fila cargada.
+# Uso: python etl.py --backfill [--desde N] [--hasta M] [--bloque K] [--reiniciar]
+TAMANO_BLOQUE_BACKFILL = 20000
+ID_CHECKPOINT_BACKFILL = "etl_backfill"
+
+# --- EXTRACCIÓN EN PARALELO ---
+# Procesos para leer los tres libros a la vez (1 = secuencial en el mismo proceso)
+WORKERS_EXTRACCION = 3
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- FUNCIONES DE LIMPIEZA ---
@@ -79,77 +162,450 @@ def convertir_fecha_excel(valor):
         except:
             return None
 
-def extract_master() -> pd.DataFrame | None:
+# Rango de seriales de Excel representables como Timestamp de pandas (en días completos)
+ORIGEN_EXCEL = pd.Timestamp('1899-12-30')
+SERIAL_EXCEL_MIN = (pd.Timestamp.min.ceil('D').to_pydatetime() - ORIGEN_EXCEL.to_pydatetime()).days
+SERIAL_EXCEL_MAX = (pd.Timestamp.max.floor('D').to_pydatetime() - ORIGEN_EXCEL.to_pydatetime()).days
+
+def limpiar_op_serie(serie: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de limpiar_op para una columna completa.
+    Los valores numéricos se convierten en una sola pasada; solo el residuo
+    de texto pasa por limpiar_op valor por valor.
+    """
+    numeros = pd.to_numeric(serie, errors='coerce')
+    if pd.api.types.is_bool_dtype(numeros):
+        # Columna solo de booleanos: limpiar_op los trata como 1/0
+        numeros = numeros.astype('int64')
+    es_numero = numeros.abs() < 2**63
+    es_residuo = serie.notna() & ~es_numero
+
+    # Se arma sobre un arreglo object de numpy: asignar None en una Series lo vuelve NaN,
+    # y los vacíos tienen que quedar como None igual que en limpiar_op
+    resultado = np.full(len(serie), None, dtype=object)
+    resultado[es_numero.to_numpy()] = numeros[es_numero].astype('int64').astype(str).to_numpy(dtype=object)
+    resultado[es_residuo.to_numpy()] = [limpiar_op(valor) for valor in serie[es_residuo]]
+    return pd.Series(resultado, index=serie.index, dtype=object)
+
+def rellenar_vacios(serie: pd.Series, valor) -> pd.Series:
+    """ fillna que también sirve para columnas category (agrega `valor` a las categorías si hace falta). """
+    if isinstance(serie.dtype, pd.CategoricalDtype) and valor not in serie.cat.categories and serie.hasnans:
+        serie = serie.cat.add_categories([valor])
+    return serie.fillna(valor)
+
+def aplicar_esquema(df: pd.DataFrame) -> pd.DataFrame:
+    """ Convierte las columnas presentes a los tipos de ESQUEMA_PEDIDOS. """
+    tipos = {col: tipo for col, tipo in ESQUEMA_PEDIDOS.items() if col in df.columns}
+    df = df.astype(tipos)
+    for col in COLUMNAS_CATEGORICAS.intersection(df.columns):
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+def registrar_memoria(etapa: str, df: pd.DataFrame):
+    """ Log de la memoria real (deep=True, cuenta los strings) de un DataFrame; en DEBUG, por columna. """
+    if not PERFILAR_MEMORIA or df is None:
+        return
+    por_columna = df.memory_usage(deep=True, index=True)
+    logging.info(f"Memoria {etapa}: {por_columna.sum() / 2**20:,.1f} MB ({len(df)} filas x {len(df.columns)} columnas)")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        detalle = ", ".join(
+            f"{col}={bytes_ / 2**20:,.2f} MB ({df[col].dtype})"
+            for col, bytes_ in por_columna.drop("Index").items()
+        )
+        logging.debug(f"Memoria {etapa} por columna: {detalle}")
+
+def convertir_fecha_excel_serie(serie: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de convertir_fecha_excel para una columna completa.
+    Los seriales numéricos se convierten con un solo to_datetime; solo el
+    residuo de texto pasa por convertir_fecha_excel valor por valor.
+    Los seriales o textos fuera del rango de datetime64[ns] (ej. un 1000000 tecleado
+    por error) quedan como NaT: ESQUEMA_PEDIDOS no los podría representar.
+    """
+    numeros = pd.to_numeric(serie, errors='coerce')
+    es_serial = numeros.between(SERIAL_EXCEL_MIN, SERIAL_EXCEL_MAX)
+    es_residuo = serie.notna() & numeros.isna()
+    fuera_de_rango = int((numeros.notna() & ~es_serial).sum())
+
+    fechas = pd.to_datetime(numeros[es_serial], unit='D', origin=ORIGEN_EXCEL)
+    if es_residuo.any():
+        residuo = pd.to_datetime(serie[es_residuo].map(convertir_fecha_excel))
+        en_rango = residuo.between(pd.Timestamp.min, pd.Timestamp.max)
+        fuera_de_rango += int((residuo.notna() & ~en_rango).sum())
+        fechas = pd.concat([fechas, residuo.where(en_rango).astype('datetime64[ns]')])
+    if fuera_de_rango:
+        logging.warning(f"{serie.name}: {fuera_de_rango} fechas fuera de rango quedan vacías.")
+    return fechas.reindex(serie.index)
+
+def convertir_entero_serie(serie: pd.Series, tipo: str) -> pd.Series:
+    """
+    Columna numérica del Excel al entero `tipo` de ESQUEMA_PEDIDOS. Lo vacío o no numérico
+    queda en 0; los valores que `tipo` no puede representar se recortan a su límite (astype
+    los daría la vuelta en silencio: 3e9 -> -2147483648 en int32), así un PIEZAS enorme
+    sigue siendo enorme para el cálculo del estatus, como con el astype(int) de antes.
+    """
+    numeros = pd.to_numeric(serie, errors='coerce')
+    if pd.api.types.is_bool_dtype(numeros):
+        numeros = numeros.astype('int64')
+    limites = np.iinfo(tipo)
+    fuera_de_rango = numeros.notna() & ~numeros.between(limites.min, limites.max)
+    if fuera_de_rango.any():
+        logging.warning(f"{serie.name}: {int(fuera_de_rango.sum())} valores fuera del rango de {tipo} se recortan al límite.")
+    return numeros.clip(limites.min, limites.max).fillna(0).astype(tipo)
+
+def convertir_celda_xlsb(valor):
+    """ Misma conversión que aplica pandas a las celdas de pyxlsb (enteros exactos como int). """
+    if isinstance(valor, float):
+        val_int = int(valor)
+        if val_int == valor:
+            return val_int
+    return valor
+
+def armar_maestra(datos: dict) -> pd.DataFrame:
+    """ DataFrame de la MAESTRA a partir de las listas por columna (texto repetido como category). """
+    return pd.DataFrame({
+        nombre: pd.Categorical(valores) if COLUMNS_MAP[nombre] in COLUMNAS_CATEGORICAS else valores
+        for nombre, valores in datos.items()
+    })
+
+@contextmanager
+def abrir_maestra():
+    """
+    Abre la MAESTRA una sola vez y entrega (indices, filas): la cabecera se lee con el mismo
+    iterador de filas de pyxlsb que luego recorren los datos, y la posición de cada columna
+    de COLUMNS_MAP se resuelve por nombre normalizado (ver cabeceras.py; las que no están se
+    omiten). `filas` queda justo después de la cabecera.
+    """
+    with open_workbook(FILE_MASTER_LIST) as wb:
+        with wb.get_sheet(SHEET_MASTER_LIST) as sheet:
+            # sparse=True: pyxlsb no rellena las filas vacías
+            filas = iter(sheet.rows(sparse=True))
+            cabecera = []
+            for row in filas:
+                if row[0].r + 1 == FILA_CABECERA_EXCEL:
+                    cabecera = [cell.v for cell in row]
+                    break
+                if row[0].r + 1 > FILA_CABECERA_EXCEL:
+                    # Sin fila de cabecera: la fila ya leída se regresa al iterador
+                    filas = chain([row], filas)
+                    break
+            indices = indices_columnas(FILE_MASTER_LIST, SHEET_MASTER_LIST, FILA_CABECERA_EXCEL, cabecera, COLUMNS_MAP)
+            yield indices, filas
+
+def filas_maestra(indices: dict, filas, fila_inicio: int, fila_fin: int | None = None):
+    """
+    Genera (num_fila, valores) de las filas de abrir_maestra, desde fila_inicio hasta
+    fila_fin (None = final de la hoja), en numeración de Excel. `valores` trae solo las
+    columnas de `indices`, en ese orden; lee en streaming y se detiene al pasar la fila final.
+    """
+    posiciones = list(indices.values())
+    for row in filas:
+        num_fila = row[0].r + 1
+        if fila_fin is not None and num_fila > fila_fin:
+            break
+        if num_fila >= fila_inicio and num_fila > FILA_CABECERA_EXCEL:
+            yield num_fila, [
+                convertir_celda_xlsb(row[idx].v if idx < len(row) else None) for idx in posiciones
+            ]
+
+def armar_maestra_filas(indices: dict, filas: list) -> pd.DataFrame:
+    """ armar_maestra a partir de una lista de (num_fila, valores). """
+    columnas = [list(valores) for valores in zip(*(valores for _, valores in filas))] or [[] for _ in indices]
+    return armar_maestra(dict(zip(indices, columnas)))
+
+def iterar_bloques_maestra(fila_inicio: int, fila_fin: int | None, tamano_bloque: int):
+    """
+    Genera (primera_fila, ultima_fila, df) por cada bloque de `tamano_bloque` filas de Excel
+    entre fila_inicio y fila_fin (None = hasta el final de la hoja). Solo materializa
+    las columnas de COLUMNS_MAP y solo un bloque a la vez; los bloques sin datos se omiten.
+    """
+    bloque_inicio = fila_inicio
+    filas = []
+    with abrir_maestra() as (indices, filas_libro):
+        for num_fila, valores in filas_maestra(indices, filas_libro, fila_inicio, fila_fin):
+            if num_fila >= bloque_inicio + tamano_bloque:
+                # La fila ya es de otro bloque: se entrega el actual y se vacía
+                if filas:
+                    yield bloque_inicio, bloque_inicio + tamano_bloque - 1, armar_maestra_filas(indices, filas)
+                    filas = []
+                bloque_inicio += (num_fila - bloque_inicio) // tamano_bloque * tamano_bloque
+            filas.append((num_fila, valores))
+
+    if filas:
+        ultima_fila = bloque_inicio + tamano_bloque - 1
+        yield bloque_inicio, min(ultima_fila, fila_fin) if fila_fin is not None else filas[-1][0], \
+            armar_maestra_filas(indices, filas)
+
+def extract_master(fila_inicio: int = FILA_INICIO_DATOS, fila_fin: int = FILA_FIN_DATOS) -> pd.DataFrame | None:
+    """
+    Lee la ventana fija fila_inicio..fila_fin de la MAESTRA en una sola pasada
+    (un solo bloque de iterar_bloques_maestra); se detiene al pasar la fila final.
+    """
     logging.info(f"Extrayendo MAESTRA desde: {FILE_MASTER_LIST}")
     try:
-        # Paso 1: Leer solo encabezados
-        df_header = pd.read_excel(
-            FILE_MASTER_LIST,
-            sheet_name=SHEET_MASTER_LIST,
-            engine='pyxlsb', 
-            header=FILA_CABECERA_EXCEL - 1, 
-            nrows=0 
-        )
-        columnas_reales = list(df_header.columns)
+        logging.info(f"Leyendo datos rango: {fila_inicio} a {fila_fin}...")
+        bloques = iterar_bloques_maestra(fila_inicio, fila_fin, fila_fin - fila_inicio + 1)
+        df = next((df for _, _, df in bloques), None)
+        if df is None:
+            df = pd.DataFrame(columns=list(COLUMNS_MAP))
+        logging.info(f"Filas leídas correctamente: {len(df)}")
+        return df
+    except Exception as e:
+        logging.error(f"Error al leer la MAESTRA: {e}")
+        return None
 
-        logging.info(f"Leyendo datos rango: {FILA_INICIO_DATOS} a {FILA_FIN_DATOS}...")
-        
-        idx_inicio = FILA_INICIO_DATOS - 1
-        idx_fin = FILA_FIN_DATOS - 1
+# --- VENTANA AUTOMÁTICA ---
+def ingreso_reciente(valor, limite: pd.Timestamp, limite_serial: float) -> bool:
+    """ True si la celda de Ingreso (serial de Excel o texto) es igual o posterior a `limite`. """
+    if isinstance(valor, bool) or valor is None:
+        return False
+    if isinstance(valor, (int, float)):
+        return limite_serial <= valor <= SERIAL_EXCEL_MAX
+    fecha = convertir_fecha_excel(valor)
+    return fecha is not None and not pd.isna(fecha) and fecha >= limite
 
-        def logica_filas_datos(x):
-            if x < idx_inicio: return True
-            if x > idx_fin: return True
-            return False
+def leer_ventana_activa(fila_lectura: int, limite: pd.Timestamp) -> dict:
+    """
+    Una sola pasada desde fila_lectura hasta el final de la hoja. Solo se guardan las filas a
+    partir de la primera con Ingreso >= limite, más las de las FILAS_TRASLAPE filas de Excel
+    anteriores; se descartan las filas después de la última con OP.
+    """
+    limite_serial = (limite - ORIGEN_EXCEL).days
+    traslape = deque()
+    filas = []
+    primera_activa = ultima_op = None
 
-        # Paso 2: Leer los datos
-        df = pd.read_excel(
-            FILE_MASTER_LIST,
-            sheet_name=SHEET_MASTER_LIST,
-            engine='pyxlsb', 
-            header=None, 
-            skiprows=logica_filas_datos 
-        )
-        
-        # Asignar columnas
-        if len(df.columns) == len(columnas_reales):
-            df.columns = columnas_reales
+    with abrir_maestra() as (indices, filas_libro):
+        faltantes = {"OP", "Ingreso"} - set(indices)
+        if faltantes:
+            raise ValueError(f"La cabecera de la MAESTRA no tiene {sorted(faltantes)}, no se puede detectar la ventana.")
+        col_op, col_ingreso = list(indices).index("OP"), list(indices).index("Ingreso")
+
+        for num_fila, valores in filas_maestra(indices, filas_libro, fila_lectura):
+            op = valores[col_op]
+            if op is not None and str(op).strip() != '':
+                ultima_op = num_fila
+            if primera_activa is not None:
+                filas.append((num_fila, valores))
+            elif ingreso_reciente(valores[col_ingreso], limite, limite_serial):
+                primera_activa = num_fila
+                filas.extend(fila for fila in traslape if fila[0] >= num_fila - FILAS_TRASLAPE)
+                filas.append((num_fila, valores))
+            else:
+                traslape.append((num_fila, valores))
+                while traslape[0][0] < num_fila - FILAS_TRASLAPE:
+                    traslape.popleft()
+
+    if ultima_op is not None:
+        filas = [(num_fila, valores) for num_fila, valores in filas if num_fila <= ultima_op]
+    return {
+        "df": armar_maestra_filas(indices, filas),
+        "primera_activa": primera_activa,
+        "primera_fila": filas[0][0] if filas else None,
+        "ultima_op": ultima_op,
+    }
+
+def leer_marca_maestra(db) -> dict:
+    return db[COLECCION_METADATOS].find_one({"_id": ID_MARCA_MAESTRA}) or {}
+
+def guardar_marca_maestra(db, ventana: dict):
+    db[COLECCION_METADATOS].update_one(
+        {"_id": ID_MARCA_MAESTRA},
+        {"$set": {"primera_activa": ventana["primera_activa"], "ultima_op": ventana["ultima_op"],
+                  "dias_historia": DIAS_HISTORIA, "actualizado": datetime.now()}},
+        upsert=True
+    )
+
+def marca_vigente(marca: dict, ventana: dict) -> bool:
+    """
+    La lectura que empezó en la marca es confiable salvo que la hoja se haya recortado
+    (la última OP quedó antes que la de la corrida anterior) o que la ventana se haya
+    recorrido hacia atrás (ej. subió DIAS_HISTORIA): entonces podría empezar antes de lo leído.
+    """
+    if ventana["ultima_op"] is None or ventana["ultima_op"] < (marca.get("ultima_op") or 0):
+        return False
+    return ventana["primera_activa"] is None or ventana["primera_activa"] >= marca["primera_activa"]
+
+def extract_master_automatica(escaneo_completo: bool = False) -> pd.DataFrame | None:
+    """
+    Lee la MAESTRA con la ventana detectada (ver VENTANA AUTOMÁTICA). Con marca de la corrida
+    anterior se empieza a leer en primera_activa - FILAS_TRASLAPE; sin marca, o si la marca
+    ya no cuadra con la hoja, se recorre desde la cabecera. Sin Mongo se lee sin marca.
+    """
+    logging.info(f"Extrayendo MAESTRA desde: {FILE_MASTER_LIST} (ventana automática, {DIAS_HISTORIA} días)")
+    client = None
+    try:
+        db, marca = None, {}
+        try:
+            client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+            db = client[DB_NAME]
+            marca = {} if escaneo_completo else leer_marca_maestra(db)
+        except Exception as e:
+            logging.warning(f"No se pudo leer la marca de la MAESTRA, se lee desde la cabecera: {e}")
+            db = None
+
+        limite = pd.Timestamp(datetime.now().date() - timedelta(days=DIAS_HISTORIA))
+        fila_lectura = FILA_CABECERA_EXCEL + 1
+        if marca.get("primera_activa"):
+            fila_lectura = max(fila_lectura, marca["primera_activa"] - FILAS_TRASLAPE)
+        ventana = leer_ventana_activa(fila_lectura, limite)
+
+        if fila_lectura > FILA_CABECERA_EXCEL + 1 and not marca_vigente(marca, ventana):
+            logging.warning("La marca de la MAESTRA ya no cuadra con la hoja, se busca la ventana desde la cabecera.")
+            fila_lectura = FILA_CABECERA_EXCEL + 1
+            ventana = leer_ventana_activa(fila_lectura, limite)
+
+        df = ventana["df"]
+        if ventana["primera_activa"] is None:
+            logging.warning(f"Ningún pedido con Ingreso desde {limite.date()} (lectura desde la fila {fila_lectura}).")
         else:
-            min_cols = min(len(df.columns), len(columnas_reales))
-            df = df.iloc[:, :min_cols]
-            df.columns = columnas_reales[:min_cols]
+            logging.info(
+                f"Ventana detectada: filas {ventana['primera_fila']} a {ventana['ultima_op']} "
+                f"(Ingreso >= {limite.date()} desde la fila {ventana['primera_activa']}, lectura desde la fila {fila_lectura})."
+            )
+        if db is not None and ventana["ultima_op"] is not None:
+            try:
+                guardar_marca_maestra(db, ventana)
+            except Exception as e:
+                logging.warning(f"No se pudo guardar la marca de la MAESTRA: {e}")
 
         logging.info(f"Filas leídas correctamente: {len(df)}")
         return df
     except Exception as e:
         logging.error(f"Error al leer la MAESTRA: {e}")
         return None
+    finally:
+        if client: client.close()
 
 def extract_plancor() -> pd.DataFrame | None:
     logging.info(f"Extrayendo PLANCOR desde: {FILE_PLANCOR}")
-    try:
+    def leer_plancor():
         df = pd.read_excel(FILE_PLANCOR, sheet_name=SHEET_PLANCOR, usecols="A,AY", engine='openpyxl')
         df.columns = ['op_plancor', 'cantidad_plancor']
-        df['op_plancor'] = df['op_plancor'].apply(limpiar_op)
+        df['op_plancor'] = limpiar_op_serie(df['op_plancor'])
         return df
+
+    try:
+        return leer_con_cache(FILE_PLANCOR, leer_plancor, hoja=SHEET_PLANCOR, columnas="A,AY")
     except Exception as e:
         logging.error(f"Error al leer PLANCOR: {e}")
         return None
 
 def extract_terminado() -> pd.DataFrame | None:
     logging.info(f"Extrayendo TERMINADO desde: {FILE_TERMINADO}")
-    try:
+    def leer_terminado():
         df = pd.read_excel(FILE_TERMINADO, sheet_name=SHEET_TERMINADO, usecols="A", engine='openpyxl')
         df.columns = ['op_terminado']
-        df['op_terminado'] = df['op_terminado'].apply(limpiar_op)
+        df['op_terminado'] = limpiar_op_serie(df['op_terminado'])
         df.dropna(subset=['op_terminado'], inplace=True)
         df['existe_en_terminado'] = True
         df.drop_duplicates(subset=['op_terminado'], inplace=True)
         return df
+
+    try:
+        return leer_con_cache(FILE_TERMINADO, leer_terminado, hoja=SHEET_TERMINADO, columnas="A")
     except Exception as e:
         logging.error(f"Error al leer TERMINADO: {e}")
         return None
 
+EXTRACTORES = {
+    "MAESTRA": extract_master_automatica if VENTANA_AUTOMATICA else extract_master,
+    "PLANCOR": extract_plancor,
+    "TERMINADO": extract_terminado,
+}
+
+def extraer_fuente(nombre: str, **kwargs):
+    """ Ejecuta un extractor y devuelve el DataFrame junto con los segundos que tardó. """
+    inicio = time.perf_counter()
+    df = EXTRACTORES[nombre](**kwargs)
+    return df, time.perf_counter() - inicio
+
+def extract_all(workers: int = WORKERS_EXTRACCION, argumentos: dict | None = None) -> dict:
+    """
+    Extrae MAESTRA, PLANCOR y TERMINADO en procesos separados (el parseo es CPU).
+    Cada fuente falla de forma aislada: si un libro no se puede leer su valor es None
+    y las demás se siguen leyendo. `argumentos` (nombre -> kwargs) se pasan a cada extractor.
+    """
+    argumentos = argumentos or {}
+    logging.info(f"Extrayendo {len(EXTRACTORES)} fuentes con {workers} proceso(s)...")
+    inicio = time.perf_counter()
+    resultados = {}
+
+    def registrar(nombre, df, segundos):
+        resultados[nombre] = df
+        if df is None:
+            logging.error(f"{nombre}: falló después de {segundos:.1f} s")
+        else:
+            logging.info(f"{nombre}: {len(df)} filas en {segundos:.1f} s")
+            registrar_memoria(nombre, df)
+
+    if workers <= 1:
+        for nombre in EXTRACTORES:
+            registrar(nombre, *extraer_fuente(nombre, **argumentos.get(nombre, {})))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futuros = {executor.submit(extraer_fuente, nombre, **argumentos.get(nombre, {})): nombre
+                       for nombre in EXTRACTORES}
+            for futuro in as_completed(futuros):
+                nombre = futuros[futuro]
+                try:
+                    registrar(nombre, *futuro.result())
+                except Exception as e:
+                    logging.error(f"{nombre}: el proceso de extracción terminó con error: {e}")
+                    resultados[nombre] = None
+
+    logging.info(f"Extracción terminada en {time.perf_counter() - inicio:.1f} s")
+    return resultados
+
+def agregar_plancor(df_plancor: pd.DataFrame, politica: str = POLITICA_PLANCOR) -> pd.Series:
+    """
+    cantidad_plancor por OP (índice único). Las OPs que vienen una sola vez conservan su
+    valor tal cual; las repetidas se combinan con `politica` ("sum" o "max").
+    """
+    df = df_plancor.dropna(subset=['op_plancor'])
+    repetida = df['op_plancor'].duplicated(keep=False)
+    cantidades = df.loc[~repetida].set_index('op_plancor')['cantidad_plancor']
+    if repetida.any():
+        grupos = pd.to_numeric(df.loc[repetida, 'cantidad_plancor'], errors='coerce')\
+            .groupby(df.loc[repetida, 'op_plancor'], sort=False)
+        # min_count=1: si todas las cantidades de la OP están vacías queda NaN (SIN PROGRAMAR)
+        combinadas = grupos.sum(min_count=1) if politica == "sum" else grupos.max()
+        logging.warning(f"PLANCOR: {len(combinadas)} OPs repetidas, cantidades combinadas con '{politica}'.")
+        cantidades = pd.concat([cantidades, combinadas])
+    return cantidades
+
+def combinar_plancor_terminado(df_master: pd.DataFrame, df_plancor: pd.DataFrame,
+                               df_terminado: pd.DataFrame, politica: str = POLITICA_PLANCOR) -> pd.DataFrame:
+    """
+    Agrega a la maestra cantidad_plancor y existe_en_terminado (bool) sin pd.merge:
+    las OPs de las tres tablas se codifican juntas como enteros en un solo factorize y
+    las búsquedas son indexación de arreglos. PLANCOR se agrega por OP, así nunca
+    multiplica renglones de la maestra.
+    """
+    cantidades = agregar_plancor(df_plancor, politica)
+    ops_terminado = df_terminado['op_terminado'].dropna()
+    n_master, n_plancor = len(df_master), len(cantidades)
+
+    codigos, ops_unicas = pd.factorize(pd.concat(
+        [df_master['OP'], cantidades.index.to_series(), ops_terminado], ignore_index=True
+    ))
+    cod_master = codigos[:n_master]
+    cod_plancor = codigos[n_master:n_master + n_plancor]
+    cod_terminado = codigos[n_master + n_plancor:]
+
+    # Cantidad por código (NaN = OP sin PLANCOR, igual que el merge)
+    if pd.api.types.is_numeric_dtype(cantidades):
+        cantidad_por_codigo = np.full(len(ops_unicas), np.nan)
+    else:
+        cantidad_por_codigo = np.full(len(ops_unicas), np.nan, dtype=object)
+    cantidad_por_codigo[cod_plancor] = cantidades.to_numpy()
+    en_terminado = np.zeros(len(ops_unicas), dtype=bool)
+    en_terminado[cod_terminado] = True
+
+    df = df_master.reset_index(drop=True)
+    df['cantidad_plancor'] = cantidad_por_codigo[cod_master]
+    df['existe_en_terminado'] = en_terminado[cod_master]
+    return df
 
 def transform(df_master, df_plancor, df_terminado) -> pd.DataFrame | None:
     logging.info("Iniciando transformación...")
@@ -168,19 +624,19 @@ def transform(df_master, df_plancor, df_terminado) -> pd.DataFrame | None:
     df_master.rename(columns=COLUMNS_MAP, inplace=True)
     
     # Limpieza OP Principal
-    df_master['OP'] = df_master['OP'].apply(limpiar_op)
+    df_master['OP'] = limpiar_op_serie(df_master['OP'])
     df_master.dropna(subset=['OP'], inplace=True)
     
     # Conversión de Tipos numéricos
     df_master['M2'] = pd.to_numeric(df_master['M2'], errors='coerce').fillna(0.0)
     for col in ['ANCHO', 'LARGO', 'PIEZAS']:
-        df_master[col] = pd.to_numeric(df_master[col], errors='coerce').fillna(0).astype(int)
+        df_master[col] = convertir_entero_serie(df_master[col], ESQUEMA_PEDIDOS[col])
     
     # --- CORRECCIÓN DE FECHAS AQUÍ ---
-    # Usamos la nueva función helper para convertir seriales de Excel
+    # Conversión vectorizada de seriales de Excel (el texto cae al helper por valor)
     logging.info("Convirtiendo fechas seriales de Excel...")
-    df_master['FECHA_INGRESO'] = df_master['FECHA_INGRESO'].apply(convertir_fecha_excel)
-    df_master['FECHA_ENTREGA'] = df_master['FECHA_ENTREGA'].apply(convertir_fecha_excel)
+    df_master['FECHA_INGRESO'] = convertir_fecha_excel_serie(df_master['FECHA_INGRESO'])
+    df_master['FECHA_ENTREGA'] = convertir_fecha_excel_serie(df_master['FECHA_ENTREGA'])
     
     # Filtrado lógico
     df_master.dropna(subset=['FECHA_INGRESO', 'FECHA_ENTREGA'], inplace=True)
@@ -188,16 +644,16 @@ def transform(df_master, df_plancor, df_terminado) -> pd.DataFrame | None:
     df_master = df_master[~df_master['CLIENTE'].isin(CLIENTES_EXCLUIDOS)].copy()
 
     # Rellenar vacíos (Ya NO rellenamos transporte porque se eliminó)
-    df_master['CLIENTE'] = df_master['CLIENTE'].fillna('SIN CLIENTE')
-    df_master['OC'] = df_master['OC'].fillna('SIN O/C') 
-    df_master['TIPO'] = df_master['TIPO'].fillna('SIN TIPO')
-    df_master['MATERIAL'] = df_master['MATERIAL'].fillna('SIN DATO')
-    df_master['FLAUTA'] = df_master['FLAUTA'].fillna('SIN DATO')
-    df_master['DIRECCION_ENTREGA'] = df_master['DIRECCION_ENTREGA'].fillna('SIN DATOS')
+    df_master['CLIENTE'] = rellenar_vacios(df_master['CLIENTE'], 'SIN CLIENTE')
+    df_master['OC'] = rellenar_vacios(df_master['OC'], 'SIN O/C')
+    df_master['TIPO'] = rellenar_vacios(df_master['TIPO'], 'SIN TIPO')
+    df_master['MATERIAL'] = rellenar_vacios(df_master['MATERIAL'], 'SIN DATO')
+    df_master['FLAUTA'] = rellenar_vacios(df_master['FLAUTA'], 'SIN DATO')
+    df_master['DIRECCION_ENTREGA'] = rellenar_vacios(df_master['DIRECCION_ENTREGA'], 'SIN DATOS')
+    registrar_memoria("maestra limpia", df_master)
 
     logging.info("Combinando con Plancor y Terminado...")
-    df = pd.merge(df_master, df_plancor, left_on='OP', right_on='op_plancor', how='left')
-    df = pd.merge(df, df_terminado, left_on='OP', right_on='op_terminado', how='left')
+    df = combinar_plancor_terminado(df_master, df_plancor, df_terminado)
 
     logging.info("Calculando estatus...")
     conditions = [
@@ -209,63 +665,295 @@ def transform(df_master, df_plancor, df_terminado) -> pd.DataFrame | None:
     choices = ["SIN PROGRAMAR", "INGRESADO SIN PROGRAMAR", "PROGRAMADO PARCIAL", "PROGRAMADO"]
     df['estatus_plancor'] = np.select(conditions, choices, default='ERROR')
     
-    df['ESTATUS_EXCEL'] = np.where(
-        (df['estatus_plancor'] == 'SIN PROGRAMAR') & (df['existe_en_terminado'].isna()),
+    df['ESTATUS_EXCEL'] = pd.Categorical(np.where(
+        (df['estatus_plancor'] == 'SIN PROGRAMAR') & (~df['existe_en_terminado']),
         "SIN FABRICAR",
         df['estatus_plancor']
-    )
+    ), categories=ESTATUS_POSIBLES)
     
-    df = df[df['ESTATUS_EXCEL'] != 'PROGRAMADO'].copy()
+    df = df[df['ESTATUS_EXCEL'] != 'PROGRAMADO']
     
-    # Columnas finales a guardar
+    # Columnas finales a guardar (con sus tipos; los vacíos se convierten a None en construir_operaciones)
     cols_finales = list(COLUMNS_MAP.values()) + ['ESTATUS_EXCEL']
-    df_final = df[cols_finales].copy()
-    df_final = df_final.where(pd.notnull(df_final), None)
+    df_final = aplicar_esquema(df[cols_finales])
+    registrar_memoria("transformación", df_final)
     
     logging.info(f"Transformación lista. {len(df_final)} pedidos listos.")
     return df_final
 
-def load(df: pd.DataFrame):
+def calcular_hash_pedidos(df: pd.DataFrame) -> pd.Series:
+    """ Hash de contenido por fila sobre los campos de COLUMNS_MAP + ESTATUS_EXCEL. """
+    cols_hash = list(COLUMNS_MAP.values()) + ['ESTATUS_EXCEL']
+    hashes = pd.util.hash_pandas_object(df[cols_hash], index=False)
+    return hashes.map(lambda h: f"v{VERSION_DOCUMENTO}-{h:016x}")
+
+def filtrar_pedidos_modificados(db, df: pd.DataFrame, hashes: pd.Series):
+    """
+    Compara los hashes contra los de la última carga y devuelve solo los pedidos
+    nuevos o con cambios, junto con el conteo de los que no cambiaron.
+    """
+    ops = df['OP'].tolist()
+    cursor = db[COLECCION_HASHES].find({"_id": {"$in": ops}}, {"hash": 1})
+    hashes_previos = {doc['_id']: doc['hash'] for doc in cursor}
+
+    modificados = df['OP'].map(hashes_previos) != hashes
+    sin_cambios = int((~modificados).sum())
+    return df[modificados], hashes[modificados], sin_cambios
+
+def guardar_hashes(db, ops: list, hashes: list):
+    """ Registra el hash cargado de cada OP (solo después de escribir en pedidos). """
+    operations = [
+        UpdateOne({"_id": op}, {"$set": {"hash": h}}, upsert=True)
+        for op, h in zip(ops, hashes)
+    ]
+    if operations:
+        db[COLECCION_HASHES].bulk_write(operations, ordered=False)
+
+def leer_programados(db, ops: list, tamano_lote: int = TAMANO_LOTE_CARGA) -> dict:
+    """ Fecha y M2 actuales de las OPs que ya tienen fecha asignada (para los contadores de capacidad). """
+    programados = {}
+    for i in range(0, len(ops), tamano_lote):
+        cursor = db["pedidos"].find(
+            {"OP": {"$in": ops[i:i + tamano_lote]}, "fecha_programacion_asignada": {"$type": "date"}},
+            {"_id": 0, "OP": 1, "M2": 1, "fecha_programacion_asignada": 1}
+        )
+        for doc in cursor:
+            programados[doc["OP"]] = (doc["fecha_programacion_asignada"], doc.get("M2"))
+    return programados
+
+def construir_operaciones(df: pd.DataFrame) -> list:
+    """
+    Un UpdateOne por pedido a partir de to_dict('records') (la OP ya viene limpia de transform).
+    Aquí es donde los NaN/NaT pasan a None, solo en las columnas que tienen vacíos.
+    """
+    columnas_vacias = [col for col in df.columns if df[col].hasnans]
+    operations = []
+    for doc in df.to_dict('records'):
+        for col in columnas_vacias:
+            if pd.isna(doc[col]):
+                doc[col] = None
+        op_id = doc.pop("OP")
+        # Claves normalizadas para la búsqueda por OP/CLIENTE de la API
+        doc["claves_busqueda"] = claves_busqueda(op_id, doc.get("CLIENTE"))
+        operations.append(UpdateOne({"OP": op_id}, {"$set": doc}, upsert=True))
+    return operations
+
+def escribir_lote(collection, num_lote: int, operations: list) -> dict:
+    """ Manda un lote con ordered=False y devuelve sus métricas (incluye los índices que fallaron). """
+    inicio = time.perf_counter()
+    metricas = {"lote": num_lote, "docs": len(operations), "upserted": 0, "modified": 0, "errores": 0, "fallidos": []}
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        metricas["upserted"] = result.upserted_count
+        metricas["modified"] = result.modified_count
+    except BulkWriteError as e:
+        detalles = e.details
+        metricas["upserted"] = detalles.get("nUpserted", 0)
+        metricas["modified"] = detalles.get("nModified", 0)
+        metricas["fallidos"] = [err["index"] for err in detalles.get("writeErrors", [])]
+        metricas["errores"] = len(metricas["fallidos"])
+        if metricas["fallidos"]:
+            logging.error(f"Lote {num_lote}: primer error -> {detalles['writeErrors'][0].get('errmsg')}")
+
+    segundos = max(time.perf_counter() - inicio, 1e-9)
+    logging.info(
+        f"Lote {num_lote}: {metricas['docs']} docs en {segundos:.2f} s ({metricas['docs'] / segundos:,.0f} docs/s) - "
+        f"{metricas['upserted']} nuevos, {metricas['modified']} actualizados, {metricas['errores']} errores"
+    )
+    return metricas
+
+def cargar_pedidos(db, df: pd.DataFrame, incremental: bool = MODO_INCREMENTAL,
+                   tamano_lote: int = TAMANO_LOTE_CARGA, hilos: int = HILOS_CARGA) -> int:
+    """
+    Escribe los pedidos transformados en `db` (hashes, contadores de capacidad y versión
+    de datos incluidos). Devuelve el número de pedidos que Mongo rechazó; los errores de
+    conexión se propagan.
+    """
+    hashes = calcular_hash_pedidos(df)
+    if incremental:
+        df, hashes, sin_cambios = filtrar_pedidos_modificados(db, df, hashes)
+        logging.info(f"Modo incremental: {sin_cambios} sin cambios, {len(df)} nuevos o modificados.")
+    registrar_memoria("carga", df)
+
+    operations = construir_operaciones(df)
+    if not operations:
+        logging.info("No hay datos para cargar.")
+        return 0
+
+    # El ETL no mueve fechas, pero si cambia el M2 de un pedido programado hay que ajustar su día
+    programados = leer_programados(db, df['OP'].tolist(), tamano_lote)
+
+    lotes = [operations[i:i + tamano_lote] for i in range(0, len(operations), tamano_lote)]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(hilos, 1)) as executor:
+        metricas = list(executor.map(
+            lambda args: escribir_lote(db["pedidos"], *args), enumerate(lotes, start=1)
+        ))
+    segundos = max(time.perf_counter() - inicio, 1e-9)
+
+    upserted = sum(m["upserted"] for m in metricas)
+    modified = sum(m["modified"] for m in metricas)
+    errores = sum(m["errores"] for m in metricas)
+    logging.info(
+        f"Resultado Mongo: {upserted} nuevos, {modified} actualizados, {errores} errores "
+        f"({len(operations) / segundos:,.0f} docs/s en {len(lotes)} lotes)."
+    )
+
+    # Solo registramos el hash de lo que sí quedó escrito
+    ops = df['OP'].tolist()
+    hashes = hashes.tolist()
+    escritos = []
+    for m in metricas:
+        desplazamiento = (m["lote"] - 1) * tamano_lote
+        fallidos = {desplazamiento + i for i in m["fallidos"]}
+        escritos.extend(
+            i for i in range(desplazamiento, desplazamiento + m["docs"]) if i not in fallidos
+        )
+    guardar_hashes(db, [ops[i] for i in escritos], [hashes[i] for i in escritos])
+
+    m2s = df['M2'].tolist()
+    deltas = {}
+    for i in escritos:
+        if ops[i] in programados:
+            fecha, m2_anterior = programados[ops[i]]
+            registrar_cambio(deltas, fecha, m2_anterior, fecha, m2s[i])
+    aplicar_deltas(db, deltas)
+    # La API descarta sus respuestas cacheadas al ver la nueva versión
+    marcar_datos_actualizados(db)
+    return errores
+
+def load(df: pd.DataFrame, incremental: bool = MODO_INCREMENTAL,
+         tamano_lote: int = TAMANO_LOTE_CARGA, hilos: int = HILOS_CARGA):
     logging.info("Cargando a MongoDB...")
     client = None
     try:
         client = MongoClient(MONGO_URI)
         db = client[DB_NAME]
-        collection = db["pedidos"]
-
-        operations = []
-        for _, row in df.iterrows():
-            doc = row.to_dict()
-            op_id = limpiar_op(doc.pop("OP"))
-            if op_id:
-                operations.append(
-                    UpdateOne({"OP": op_id}, {"$set": doc}, upsert=True)
-                )
-
-        if operations:
-            result = collection.bulk_write(operations)
-            logging.info(f"Resultado Mongo: {result.upserted_count} nuevos, {result.modified_count} actualizados.")
-        else:
-            logging.info("No hay datos para cargar.")
+        asegurar_indices(db)
+        completar_claves_busqueda(db)
+        cargar_pedidos(db, df, incremental, tamano_lote, hilos)
     except Exception as e:
         logging.error(f"Error en carga a MongoDB: {e}")
     finally:
         if client: client.close()
 
-def main():
-    logging.info(f"--- Iniciando ETL (Rango {FILA_INICIO_DATOS} - {FILA_FIN_DATOS}) ---") 
-    df_master = extract_master()
-    df_plancor = extract_plancor()
-    df_terminado = extract_terminado()
-    
-    if df_master is not None and df_plancor is not None and df_terminado is not None:
-        df_transformado = transform(df_master, df_plancor, df_terminado)
+# --- BACKFILL ---
+def leer_checkpoint(db, fila_inicio: int, fila_fin: int | None) -> int | None:
+    """ Última fila cargada por un backfill anterior del mismo rango (None si no hay). """
+    doc = db[COLECCION_METADATOS].find_one({"_id": ID_CHECKPOINT_BACKFILL})
+    if doc and doc.get("fila_inicio") == fila_inicio and doc.get("fila_fin") == fila_fin:
+        return doc.get("ultima_fila")
+    return None
+
+def guardar_checkpoint(db, fila_inicio: int, fila_fin: int | None, ultima_fila: int):
+    db[COLECCION_METADATOS].update_one(
+        {"_id": ID_CHECKPOINT_BACKFILL},
+        {"$set": {"fila_inicio": fila_inicio, "fila_fin": fila_fin,
+                  "ultima_fila": ultima_fila, "actualizado": datetime.now()}},
+        upsert=True
+    )
+
+def transformar_bloques(bloques, df_plancor: pd.DataFrame, df_terminado: pd.DataFrame):
+    """ Etapa transform del backfill: (primera_fila, ultima_fila, df transformado o None). """
+    for primera, ultima, df_bloque in bloques:
+        registrar_memoria(f"bloque {primera}-{ultima}", df_bloque)
+        yield primera, ultima, transform(df_bloque, df_plancor, df_terminado)
+
+def backfill(fila_inicio: int = FILA_INICIO_DATOS, fila_fin: int | None = None,
+             tamano_bloque: int = TAMANO_BLOQUE_BACKFILL, incremental: bool = MODO_INCREMENTAL,
+             reiniciar: bool = False) -> bool:
+    """
+    Carga la MAESTRA de fila_inicio a fila_fin (None = hasta el final) bloque por bloque.
+    PLANCOR y TERMINADO se leen una vez; de la MAESTRA solo hay un bloque en memoria.
+    Después de cargar cada bloque se guarda la última fila en metadatos, así una corrida
+    interrumpida continúa desde ahí. Se detiene sin avanzar el checkpoint si un bloque
+    no se pudo transformar o Mongo rechazó pedidos.
+    """
+    logging.info(f"--- Backfill (filas {fila_inicio} - {fila_fin or 'final'}, bloques de {tamano_bloque}) ---")
+    client = MongoClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        asegurar_indices(db)
+        completar_claves_busqueda(db)
+
+        desde = fila_inicio
+        if reiniciar:
+            db[COLECCION_METADATOS].delete_one({"_id": ID_CHECKPOINT_BACKFILL})
+        else:
+            ultima = leer_checkpoint(db, fila_inicio, fila_fin)
+            if ultima is not None:
+                desde = ultima + 1
+                logging.info(f"Continuando desde el checkpoint: fila {desde}.")
+        if fila_fin is not None and desde > fila_fin:
+            logging.info("El rango ya estaba cargado completo.")
+            return True
+
+        df_plancor, df_terminado = extract_plancor(), extract_terminado()
+        if df_plancor is None or df_terminado is None:
+            logging.error("No se pudieron leer PLANCOR/TERMINADO, backfill cancelado.")
+            return False
+
+        inicio = time.perf_counter()
+        filas = pedidos = 0
+        bloques = iterar_bloques_maestra(desde, fila_fin, tamano_bloque)
+        for primera, ultima, df in transformar_bloques(bloques, df_plancor, df_terminado):
+            if df is None:
+                logging.error(f"Bloque {primera}-{ultima}: falló la transformación, backfill detenido.")
+                return False
+            if not df.empty:
+                errores = cargar_pedidos(db, df, incremental)
+                if errores:
+                    logging.error(f"Bloque {primera}-{ultima}: {errores} pedidos rechazados, backfill detenido.")
+                    return False
+            guardar_checkpoint(db, fila_inicio, fila_fin, ultima)
+            filas += ultima - primera + 1
+            pedidos += len(df)
+            logging.info(
+                f"Bloque {primera}-{ultima} cargado: {len(df)} pedidos "
+                f"(acumulado {pedidos} pedidos, {filas / max(time.perf_counter() - inicio, 1e-9):,.0f} filas/s)."
+            )
+        logging.info(f"Backfill terminado en {time.perf_counter() - inicio:.1f} s: {pedidos} pedidos.")
+        return True
+    except Exception as e:
+        logging.error(f"Error en el backfill (se puede continuar desde el checkpoint): {e}")
+        return False
+    finally:
+        client.close()
+
+def main(incremental: bool = MODO_INCREMENTAL, workers: int = WORKERS_EXTRACCION, escaneo_completo: bool = False):
+    argumentos = {}
+    if VENTANA_AUTOMATICA:
+        rango = f"ventana automática, {DIAS_HISTORIA} días"
+        argumentos["MAESTRA"] = {"escaneo_completo": escaneo_completo}
+    else:
+        rango = f"Rango {FILA_INICIO_DATOS} - {FILA_FIN_DATOS}"
+    logging.info(f"--- Iniciando ETL ({rango}, incremental={incremental}) ---")
+    extraidos = extract_all(workers, argumentos)
+    fallidos = [nombre for nombre, df in extraidos.items() if df is None]
+
+    if not fallidos:
+        df_transformado = transform(extraidos["MAESTRA"], extraidos["PLANCOR"], extraidos["TERMINADO"])
         if df_transformado is not None and not df_transformado.empty:
-            load(df_transformado)
+            load(df_transformado, incremental=incremental)
         else:
             logging.warning("No hay datos válidos para cargar.")
     else:
-        logging.error("Error en extracción de archivos.")
+        logging.error(f"Error en extracción de archivos: {fallidos}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL de pedidos: MAESTRA + PLANCOR + TERMINADO -> MongoDB")
+    parser.add_argument("--completo", action="store_true", help="Recarga todos los pedidos aunque su hash no haya cambiado")
+    parser.add_argument("--escaneo-completo", action="store_true", help="Busca la ventana automática desde la cabecera, sin la marca anterior")
+    parser.add_argument("--backfill", action="store_true", help="Carga un rango grande de la MAESTRA por bloques, con checkpoint")
+    parser.add_argument("--desde", type=int, default=FILA_CABECERA_EXCEL + 1, help="Primera fila de Excel del backfill")
+    parser.add_argument("--hasta", type=int, default=None, help="Última fila de Excel del backfill (default: final de la hoja)")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE_BACKFILL, help="Filas de Excel por bloque")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignora el checkpoint y empieza en --desde")
+    args = parser.parse_args()
+
+    incremental = MODO_INCREMENTAL and not args.completo
+    if args.backfill:
+        if not backfill(args.desde, args.hasta, args.bloque, incremental, args.reiniciar):
+            raise SystemExit(1)
+    else:
+        main(incremental=incremental, escaneo_completo=args.escaneo_completo)
\ No newline at end of file
@@ -0,0 +1,114 @@
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from datetime import datetime
+import logging
+
+# --- CONFIGURACIÓN ---
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = "produccion_db"
+
+# Mismos estatus que scheduler.ESTATUS_A_PROGRAMAR (solo para la consulta de prueba del explain)
+ESTATUS_PENDIENTES = ['SIN PROGRAMAR', 'INGRESADO SIN PROGRAMAR', 'PROGRAMADO PARCIAL', 'SIN FABRICAR', 'INGRESO']
+
+# --- ÍNDICES DECLARADOS ---
+# (colección, llaves, opciones). create_index es idempotente, se puede correr en cada arranque.
+INDICES = [
+    # Upserts del ETL, fechas del scheduler y swaps: todos filtran por OP
+    ("pedidos", [("OP", 1)], {"name": "op_unico", "unique": True}),
+    # Vista por día (igualdad + orden), "Posteriores" ($gt + orden por fecha)
+    # y pendientes del scheduler (fecha null + orden prioridad, FECHA_INGRESO)
+    ("pedidos", [("fecha_programacion_asignada", 1), ("prioridad", 1), ("FECHA_INGRESO", 1)],
+     {"name": "fecha_prioridad_ingreso"}),
+    # Suma de M2 por día: índice parcial solo con pedidos programados, cubre la consulta
+    ("pedidos", [("fecha_programacion_asignada", 1), ("M2", 1)],
+     {"name": "programados_m2", "partialFilterExpression": {"fecha_programacion_asignada": {"$type": "date"}}}),
+    # Listado general /api/todos-los-pedidos ordenado por (prioridad, OP)
+    ("pedidos", [("prioridad", 1), ("OP", 1)], {"name": "prioridad_op"}),
+    # Búsqueda por prefijo/contiene de OP y CLIENTE (multikey, lo llena el ETL)
+    ("pedidos", [("claves_busqueda", 1)], {"name": "claves_busqueda"}),
+    ("calendario", [("fecha", 1)], {"name": "fecha_unica", "unique": True}),
+    ("reporte_capacidad_diaria", [("fecha", 1)], {"name": "fecha_unica", "unique": True}),
+]
+
+# --- CONSULTAS CRÍTICAS PARA EL EXPLAIN ---
+# (colección, descripción, filtro, orden)
+FECHA_PRUEBA = datetime(2000, 1, 1)
+CONSULTAS_CRITICAS = [
+    ("pedidos", "upsert por OP", {"OP": "0"}, None),
+    ("pedidos", "pedidos de un día", {"fecha_programacion_asignada": FECHA_PRUEBA},
+     [("prioridad", 1), ("FECHA_INGRESO", 1)]),
+    ("pedidos", "posteriores", {"fecha_programacion_asignada": {"$gt": FECHA_PRUEBA}},
+     [("fecha_programacion_asignada", 1)]),
+    ("pedidos", "pendientes del scheduler",
+     {"fecha_programacion_asignada": None, "ESTATUS_EXCEL": {"$in": ESTATUS_PENDIENTES}, "bloqueado": {"$ne": True}},
+     [("prioridad", 1), ("FECHA_INGRESO", 1)]),
+    ("pedidos", "carga programada", {"fecha_programacion_asignada": {"$type": "date"}}, None),
+    ("pedidos", "listado general", {}, [("prioridad", 1), ("OP", 1)]),
+    ("pedidos", "búsqueda OP/CLIENTE", {"claves_busqueda": {"$regex": "^abc"}}, None),
+    ("calendario", "regla por fecha", {"fecha": FECHA_PRUEBA}, None),
+    ("reporte_capacidad_diaria", "reporte del horizonte", {"fecha": {"$gte": FECHA_PRUEBA}}, [("fecha", 1)]),
+]
+
+
+def asegurar_indices(db):
+    """ Crea (si no existen) los índices que necesitan las consultas de la API, el ETL y el scheduler. """
+    for coleccion, llaves, opciones in INDICES:
+        try:
+            db[coleccion].create_index(llaves, **opciones)
+        except OperationFailure as e:
+            # Ej. OPs duplicadas que impiden el índice único: se reporta y se sigue con los demás
+            logging.error(f"No se pudo crear el índice {coleccion}.{opciones['name']}: {e}")
+
+def tiene_indice_unico(informacion: dict, llaves: list) -> bool:
+    """ True si index_information() de la colección trae un índice único exactamente sobre `llaves`. """
+    return any(
+        indice.get("unique") and [tuple(llave) for llave in indice.get("key", [])] == [tuple(llave) for llave in llaves]
+        for indice in informacion.values()
+    )
+
+def etapas_del_plan(plan) -> list:
+    """ Recorre el plan del explain y junta todas las etapas (COLLSCAN, IXSCAN, FETCH...). """
+    etapas = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            etapas.append(plan["stage"])
+        for valor in plan.values():
+            etapas.extend(etapas_del_plan(valor))
+    elif isinstance(plan, list):
+        for valor in plan:
+            etapas.extend(etapas_del_plan(valor))
+    return etapas
+
+def verificar_planes(db) -> list:
+    """
+    Corre explain sobre las consultas críticas y avisa si alguna hace COLLSCAN.
+    Devuelve la lista de descripciones con problema.
+    """
+    con_collscan = []
+    for coleccion, descripcion, filtro, orden in CONSULTAS_CRITICAS:
+        try:
+            cursor = db[coleccion].find(filtro)
+            if orden:
+                cursor = cursor.sort(orden)
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        except OperationFailure as e:
+            logging.error(f"No se pudo obtener el plan de '{descripcion}': {e}")
+            continue
+
+        if "COLLSCAN" in etapas_del_plan(plan):
+            logging.warning(f"⚠️ COLLSCAN en '{descripcion}' ({coleccion}, filtro={filtro})")
+            con_collscan.append(descripcion)
+
+    if not con_collscan:
+        logging.info("Todas las consultas críticas usan índice.")
+    return con_collscan
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    client = MongoClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        asegurar_indices(db)
+        verificar_planes(db)
+    finally:
+        client.close()
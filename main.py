@@ -1,21 +1,129 @@
 from fastapi import FastAPI, HTTPException, Body
-from pymongo import MongoClient, UpdateOne
+import pymongo
+from bson import Decimal128, ObjectId
+from pymongo import AsyncMongoClient, MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from datetime import datetime, time, timedelta
+import asyncio
+import base64
+import csv
+import io
+import json
+import tempfile
+from collections import OrderedDict
 import logging
 import traceback
+from time import monotonic, perf_counter
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
+# orjson es opcional: sin él las respuestas se serializan con jsonable_encoder como siempre
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# openpyxl solo se necesita para la exportación a XLSX
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+from busqueda import completar_claves_busqueda, filtro_busqueda, normalizar_texto
+from contadores import (
+    COLECCION_CONTADORES, COLECCION_METADATOS, ID_VERSION_DATOS, actualizacion_delta, migrar_contadores,
+    operaciones_contadores, reconciliar, registrar_cambio
+)
+from indices import asegurar_indices, tiene_indice_unico, verificar_planes
+from scheduler import UMBRAL_CIERRE_DIA, cargar_snapshot, simular_programacion
+
 # --- CONFIGURACIÓN ---
 MONGO_URI = "mongodb://localhost:27017/"
 DB_NAME = "produccion_db"
 CAPACIDAD_DIARIA_DEFAULT = 180000.00 
 LIMITE_CAPACIDAD_CON_TOLERANCIA = 190000.00  # 180k + 10k tolerancia
 
+# --- POOL Y TIEMPOS LÍMITE ---
+MONGO_MAX_POOL = 100          # Conexiones simultáneas máximas hacia Mongo
+MONGO_MIN_POOL = 10           # Conexiones que se mantienen abiertas
+MONGO_MAX_IDLE_MS = 60000
+DEADLINE_PETICION_S = 5.0     # Tiempo máximo de Mongo por petición normal
+DEADLINE_LISTADO_S = 15.0     # El listado general puede ser más pesado
+DEADLINE_COMPENSACION_S = 30.0  # Presupuesto propio de lo que deshace o termina un swap ya empezado
+
+# --- PAGINACIÓN ---
+TTL_CONTEO_S = 30             # Segundos que se reutiliza el total de un mismo filtro
+CACHE_CONTEOS = {}            # clave de búsqueda -> (expira, total)
+LIMITE_BUSQUEDA = 200         # Máximo de resultados por página cuando se usa "buscar"
+
+# --- CACHÉ DE RESPUESTAS (reporte y vistas por día) ---
+TTL_RESPUESTA_S = 30          # Vida máxima de una respuesta cacheada
+MAX_RESPUESTAS_CACHE = 256    # Al pasar este número se descarta la menos usada (LRU)
+VERIFICAR_VERSION_S = 2.0     # Cada cuánto se consulta la versión de datos que sube el ETL/scheduler
+CACHE_RESPUESTAS = OrderedDict()  # (endpoint, fecha) -> (expira, cuerpo JSON ya serializado)
+METRICAS_CACHE = {"aciertos": 0, "fallos": 0, "invalidaciones": 0, "desalojos": 0, "cambios_version": 0}
+ESTADO_VERSION = {"version": None, "revisado": 0.0}
+
+# Campos que no se mandan al frontend: _id (ObjectId) y las claves de búsqueda que genera el ETL
+PROYECCION_PEDIDO = {"_id": 0, "claves_busqueda": 0}
+
+# --- SIMULACIÓN ---
+TTL_SNAPSHOT_S = 300          # Vida del snapshot de pendientes/calendario/carga para los "qué pasaría si"
+SNAPSHOT_SIMULACION = {"datos": None, "expira": 0.0}
+CANDADO_SNAPSHOT = asyncio.Lock()  # Una sola carga del snapshot aunque lleguen varias simulaciones
+
+# --- INTERCAMBIOS ---
+# El apartado de capacidad depende del índice único fecha_unica de los contadores (sin él el
+# upsert condicionado duplica el día en lugar de fallar): sin índice los swaps responden 503
+LLAVES_CONTADOR = [("fecha", 1)]
+ESTADO_INTERCAMBIOS = {"indice_unico": False}
+TAREAS_RECONCILIACION = set()  # Reconciliaciones en curso (referencia para que no las recolecte el GC)
+
+# --- EXPORTACIÓN EN STREAMING ---
+TAMANO_LOTE_STREAM = 500          # Documentos por lote del cursor (y por bloque enviado)
+TAMANO_BLOQUE_ARCHIVO = 64 * 1024 # Bloques en que se manda el XLSX ya armado
+FORMATOS_EXPORTACION = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+# Columnas de CSV/XLSX: los campos que escribe el ETL más los de programación
+COLUMNAS_EXPORTACION = [
+    "OP", "CLIENTE", "TIPO", "MATERIAL", "FLAUTA", "ANCHO", "LARGO", "OC", "FECHA_INGRESO", "PIEZAS",
+    "DIRECCION_ENTREGA", "FECHA_ENTREGA", "M2", "ESTATUS_EXCEL", "prioridad",
+    "fecha_programacion_asignada", "fijo_usuario",
+]
+
+# --- SERIALIZACIÓN ---
+def serializar_bson(valor):
+    """ Tipos que orjson no conoce: los de BSON a texto/número, el resto como jsonable_encoder. """
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, Decimal128):
+        return float(valor.to_decimal())
+    return jsonable_encoder(valor)
+
+class RespuestaJSON(JSONResponse):
+    """
+    JSONResponse que serializa directo los documentos de Mongo con orjson (datetime incluido)
+    en lugar de recorrerlos campo por campo con jsonable_encoder. NaN sale como null.
+    """
+    def render(self, content) -> bytes:
+        return a_json(content)
+
+def a_json(content) -> bytes:
+    if orjson is None:
+        return json.dumps(
+            jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+    return orjson.dumps(content, default=serializar_bson)
+
 # --- INICIALIZACIÓN ---
-app = FastAPI(title="API de Programación Pycapsa (Mongo)")
+app = FastAPI(title="API de Programación Pycapsa (Mongo)", default_response_class=RespuestaJSON)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,13 +134,204 @@ app.add_middleware(
 )
 
 try:
-    client = MongoClient(MONGO_URI)
+    # Cliente asíncrono: las peticiones no ocupan un hilo mientras esperan a Mongo
+    client = AsyncMongoClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL,
+        minPoolSize=MONGO_MIN_POOL,
+        maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+    )
     db = client[DB_NAME]
     logging.info("Conexión a MongoDB establecida.")
 except Exception as e:
     logging.error(f"Error al conectar a MongoDB: {e}")
     exit()
 
+def preparar_indices():
+    # El bootstrap de índices es síncrono, usamos un cliente de corta vida
+    client_sync = MongoClient(MONGO_URI)
+    try:
+        asegurar_indices(client_sync[DB_NAME])
+        verificar_planes(client_sync[DB_NAME])
+        # asegurar_indices solo registra si un índice no se pudo crear: el de los contadores se verifica
+        informacion = client_sync[DB_NAME][COLECCION_CONTADORES].index_information()
+        ESTADO_INTERCAMBIOS["indice_unico"] = tiene_indice_unico(informacion, LLAVES_CONTADOR)
+        if not ESTADO_INTERCAMBIOS["indice_unico"]:
+            logging.error(f"Falta el índice único {COLECCION_CONTADORES}.fecha: los swaps responderán 503 hasta que exista.")
+        # Los swaps validan contra los contadores: tienen que estar reconciliados desde el despliegue
+        migrar_contadores(client_sync[DB_NAME])
+        # La búsqueda solo consulta claves_busqueda: los pedidos viejos sin ella no se encontrarían
+        completar_claves_busqueda(client_sync[DB_NAME])
+    finally:
+        client_sync.close()
+
+@app.on_event("startup")
+async def al_iniciar():
+    await run_in_threadpool(preparar_indices)
+
+@app.on_event("shutdown")
+async def al_cerrar():
+    await client.close()
+
+def codigo_error(e: Exception) -> int:
+    """ 504 si Mongo no respondió dentro del deadline de la petición, 500 para lo demás. """
+    if isinstance(e, PyMongoError) and e.timeout:
+        return 504
+    return 500
+
+# --- CACHÉ DE RESPUESTAS ---
+def leer_cache(clave):
+    guardado = CACHE_RESPUESTAS.get(clave)
+    if guardado and guardado[0] > monotonic():
+        CACHE_RESPUESTAS.move_to_end(clave)
+        METRICAS_CACHE["aciertos"] += 1
+        return Response(content=guardado[1], media_type="application/json")
+    METRICAS_CACHE["fallos"] += 1
+    return None
+
+def guardar_cache(clave, respuesta: Response):
+    CACHE_RESPUESTAS[clave] = (monotonic() + TTL_RESPUESTA_S, respuesta.body)
+    CACHE_RESPUESTAS.move_to_end(clave)
+    while len(CACHE_RESPUESTAS) > MAX_RESPUESTAS_CACHE:
+        CACHE_RESPUESTAS.popitem(last=False)
+        METRICAS_CACHE["desalojos"] += 1
+
+def invalidar_cache(claves):
+    for clave in claves:
+        if CACHE_RESPUESTAS.pop(clave, None) is not None:
+            METRICAS_CACHE["invalidaciones"] += 1
+
+def clave_dia(fecha: datetime):
+    return ("pedidos", fecha.strftime("%Y-%m-%d"))
+
+async def revisar_version_datos():
+    """
+    Si el ETL, el scheduler o otro proceso de la API cambiaron los datos (versión en
+    metadatos), se vacía la caché. Se consulta como mucho cada VERIFICAR_VERSION_S.
+    """
+    ahora = monotonic()
+    if ahora - ESTADO_VERSION["revisado"] < VERIFICAR_VERSION_S:
+        return
+    doc = await db[COLECCION_METADATOS].find_one({"_id": ID_VERSION_DATOS})
+    version = doc.get("version", 0) if doc else 0
+    if version != ESTADO_VERSION["version"]:
+        if ESTADO_VERSION["version"] is not None:
+            METRICAS_CACHE["cambios_version"] += 1
+            CACHE_RESPUESTAS.clear()
+            descartar_snapshot()
+        ESTADO_VERSION["version"] = version
+    ESTADO_VERSION["revisado"] = ahora
+
+async def publicar_cambio_datos():
+    """ Sube la versión para que los demás procesos descarten su caché; este ya invalidó lo suyo. """
+    doc = await db[COLECCION_METADATOS].find_one_and_update(
+        {"_id": ID_VERSION_DATOS},
+        {"$inc": {"version": 1}, "$set": {"actualizado": datetime.now()}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    # Si nadie más cambió nada desde la última revisión, la caché local sigue siendo válida
+    if ESTADO_VERSION["version"] is not None and doc["version"] == ESTADO_VERSION["version"] + 1:
+        ESTADO_VERSION["version"] = doc["version"]
+
+# --- SNAPSHOT DE SIMULACIÓN ---
+def descartar_snapshot():
+    SNAPSHOT_SIMULACION["datos"] = None
+
+def leer_snapshot_simulacion() -> dict:
+    # Las funciones del scheduler son síncronas, usamos un cliente de corta vida
+    client_sync = MongoClient(MONGO_URI)
+    try:
+        return cargar_snapshot(client_sync[DB_NAME])
+    finally:
+        client_sync.close()
+
+async def obtener_snapshot(refrescar: bool = False) -> dict:
+    async with CANDADO_SNAPSHOT:
+        datos = SNAPSHOT_SIMULACION["datos"]
+        # Un snapshot de ayer tiene otro horizonte de días aunque no haya caducado
+        if refrescar or datos is None or SNAPSHOT_SIMULACION["expira"] <= monotonic() \
+                or datos["creado"].date() != datetime.now().date():
+            SNAPSHOT_SIMULACION["datos"] = await run_in_threadpool(leer_snapshot_simulacion)
+            SNAPSHOT_SIMULACION["expira"] = monotonic() + TTL_SNAPSHOT_S
+        return SNAPSHOT_SIMULACION["datos"]
+
+# --- EXPORTACIÓN EN STREAMING ---
+# El cursor se recorre por lotes y cada lote se manda en cuanto está listo: StreamingResponse
+# no pide el siguiente hasta haber enviado el anterior, así la memoria no crece con el resultado.
+async def lotes_de_cursor(cursor):
+    lote = []
+    async for doc in cursor.batch_size(TAMANO_LOTE_STREAM):
+        lote.append(doc)
+        if len(lote) >= TAMANO_LOTE_STREAM:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+async def stream_ndjson(cursor):
+    async for lote in lotes_de_cursor(cursor):
+        yield b"".join(a_json(doc) + b"\n" for doc in lote)
+
+async def stream_json(cursor):
+    """ Arreglo JSON armado por pedazos: '[', los lotes separados por coma y ']'. """
+    yield b"["
+    primero = True
+    async for lote in lotes_de_cursor(cursor):
+        cuerpo = b",".join(a_json(doc) for doc in lote)
+        yield cuerpo if primero else b"," + cuerpo
+        primero = False
+    yield b"]"
+
+async def stream_csv(cursor):
+    # BOM para que Excel abra el CSV como UTF-8
+    yield ("\ufeff" + ",".join(COLUMNAS_EXPORTACION) + "\r\n").encode("utf-8")
+    async for lote in lotes_de_cursor(cursor):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([doc.get(c) for c in COLUMNAS_EXPORTACION] for doc in lote)
+        yield buffer.getvalue().encode("utf-8")
+
+def escribir_filas_xlsx(hoja, lote: list):
+    for doc in lote:
+        hoja.append([doc.get(c) for c in COLUMNAS_EXPORTACION])
+
+async def stream_xlsx(cursor):
+    """
+    Un XLSX no se puede mandar antes de cerrarlo: las filas van del cursor a un libro
+    write_only (openpyxl las escribe a un temporal en disco, no las guarda en memoria)
+    y al final el archivo se manda por bloques. openpyxl y el disco son síncronos: cada
+    lote, el guardado y la lectura de bloques corren en el threadpool, no en el event loop.
+    """
+    with tempfile.TemporaryFile() as archivo:
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet("Pedidos")
+        hoja.append(COLUMNAS_EXPORTACION)
+        async for lote in lotes_de_cursor(cursor):
+            await run_in_threadpool(escribir_filas_xlsx, hoja, lote)
+        await run_in_threadpool(libro.save, archivo)
+
+        archivo.seek(0)
+        while bloque := await run_in_threadpool(archivo.read, TAMANO_BLOQUE_ARCHIVO):
+            yield bloque
+
+GENERADORES_EXPORTACION = {"ndjson": stream_ndjson, "json": stream_json, "csv": stream_csv, "xlsx": stream_xlsx}
+
+def validar_formato(formato: str):
+    """ Respuesta de error si el formato no se puede exportar, None si está bien. """
+    if formato not in FORMATOS_EXPORTACION:
+        return JSONResponse(content={"error": f"Formato inválido, opciones: {', '.join(FORMATOS_EXPORTACION)}"}, status_code=400)
+    if formato == "xlsx" and Workbook is None:
+        return JSONResponse(content={"error": "Exportación XLSX no disponible (falta openpyxl)"}, status_code=400)
+    return None
+
+def respuesta_streaming(cursor, formato: str, nombre: str) -> StreamingResponse:
+    headers = {}
+    if formato in ("csv", "xlsx"):
+        headers["Content-Disposition"] = f'attachment; filename="{nombre}.{formato}"'
+    return StreamingResponse(
+        GENERADORES_EXPORTACION[formato](cursor), media_type=FORMATOS_EXPORTACION[formato], headers=headers
+    )
+
 # --- MODELOS ---
 class SwapRequest(BaseModel):
     ops_origen: list[str]
@@ -40,96 +339,91 @@ class SwapRequest(BaseModel):
     fecha_origen: str
     fecha_destino: str
 
-# --- HELPER PARA ACTUALIZAR GRÁFICA (REPORTES) ---
-def recalcular_capacidad_dia(fecha_dt):
-    """
-    Recalcula y actualiza el documento en reporte_capacidad_diaria para una fecha específica.
-    """
-    try:
-        fecha_iso = datetime.combine(fecha_dt.date(), time.min)
-        
-        # 1. Obtener capacidad total (Buscamos en calendario o usamos default)
-        calendario_doc = db.calendario.find_one({"fecha": fecha_iso})
-        capacidad_total = calendario_doc.get('capacidad_m2', CAPACIDAD_DIARIA_DEFAULT) if calendario_doc else CAPACIDAD_DIARIA_DEFAULT
-        
-        # 2. Sumar pedidos asignados a esa fecha
-        pipeline = [
-            {"$match": {"fecha_programacion_asignada": fecha_iso}},
-            {"$group": {"_id": None, "total_m2": {"$sum": "$M2"}, "conteo": {"$sum": 1}}}
-        ]
-        resultado = list(db.pedidos.aggregate(pipeline))
-        
-        m2_utilizados = resultado[0]['total_m2'] if resultado else 0.0
-        conteo_pedidos = resultado[0]['conteo'] if resultado else 0
-        m2_disponibles = capacidad_total - m2_utilizados
-
-        # 3. Actualizar colección de reporte
-        db.reporte_capacidad_diaria.update_one(
-            {"fecha": fecha_iso},
-            {"$set": {
-                "capacidad_total_m2": capacidad_total,
-                "m2_utilizados": m2_utilizados,
-                "m2_disponibles": m2_disponibles,
-                "conteo_pedidos": conteo_pedidos
-            }},
-            upsert=True
-        )
-        logging.info(f"♻️ Reporte actualizado para {fecha_iso.date()}")
-    except Exception as e:
-        logging.error(f"Error recalculando capacidad para {fecha_dt}: {e}")
+class SwapLoteRequest(BaseModel):
+    intercambios: list[SwapRequest]
+
+class SimulacionRequest(BaseModel):
+    capacidades: dict[str, float] = {}     # "YYYY-MM-DD" -> m2
+    excluir_ops: list[str] = []
+    prioridades: dict[str, int] = {}       # OP -> nueva prioridad
+    umbral_cierre: float | None = None
+    refrescar: bool = False                # Volver a leer el snapshot de la BD
 
+class IntercambioInvalido(Exception):
+    """ El swap no se puede aplicar tal como viene (400). """
+
+class ConflictoIntercambio(Exception):
+    """ Otro usuario cambió los mismos pedidos o la carga de los días mientras se aplicaba el swap (409). """
 
 # --- ENDPOINTS ---
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"mensaje": "API Activa V5 - Fix ObjectId"}
 
+@app.get("/api/cache-metricas")
+async def get_cache_metricas():
+    consultas = METRICAS_CACHE["aciertos"] + METRICAS_CACHE["fallos"]
+    return {
+        **METRICAS_CACHE,
+        "tasa_aciertos": METRICAS_CACHE["aciertos"] / consultas if consultas else 0.0,
+        "entradas": len(CACHE_RESPUESTAS),
+        "version_datos": ESTADO_VERSION["version"],
+    }
+
 @app.get("/api/reporte-capacidad") 
-def get_reporte_capacidad():
+async def get_reporte_capacidad():
     try:
-        # 1. Definir el Horizonte (Hoy + 5 días)
-        hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        dias_visibles = 5
-        fecha_corte = hoy + timedelta(days=dias_visibles)
-
-        # 2. Obtener días dentro del horizonte (Detallado)
-        pipeline_cercanos = [
-            {
-                "$match": {
-                    "fecha": {"$gte": hoy, "$lte": fecha_corte}
-                }
-            },
-            {"$sort": {"fecha": 1}},
-            {"$project": {"_id": 0}} # <--- CORRECCIÓN CLAVE: Eliminamos el _id que causa el error 500
-        ]
-        reporte_cercano = list(db.reporte_capacidad_diaria.aggregate(pipeline_cercanos))
-
-        # 3. Obtener todo lo posterior al horizonte (Agrupado)
-        pipeline_lejanos = [
-            {
-                "$match": {
-                    "fecha": {"$gt": fecha_corte}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "posteriores",
-                    "m2_utilizados": {"$sum": "$m2_utilizados"},
-                    "capacidad_total_m2": {"$sum": "$capacidad_total_m2"},
-                    "conteo_pedidos": {"$sum": "$conteo_pedidos"}
+        with pymongo.timeout(DEADLINE_PETICION_S):
+            await revisar_version_datos()
+            cacheada = leer_cache(("reporte",))
+            if cacheada:
+                return cacheada
+
+            # 1. Definir el Horizonte (Hoy + 5 días)
+            hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            dias_visibles = 5
+            fecha_corte = hoy + timedelta(days=dias_visibles)
+
+            # 2. Obtener días dentro del horizonte (Detallado)
+            # Son los contadores por día (un documento por fecha), no se recorren pedidos
+            pipeline_cercanos = [
+                {
+                    "$match": {
+                        "fecha": {"$gte": hoy, "$lte": fecha_corte}
+                    }
+                },
+                {"$sort": {"fecha": 1}},
+                {"$project": {"_id": 0}}, # <--- CORRECCIÓN CLAVE: Eliminamos el _id que causa el error 500
+                # Los $inc solo mueven m2_utilizados: lo disponible se calcula al leer
+                {"$addFields": {"m2_disponibles": {"$subtract": ["$capacidad_total_m2", "$m2_utilizados"]}}}
+            ]
+            reporte_cercano = await (await db[COLECCION_CONTADORES].aggregate(pipeline_cercanos)).to_list(None)
+
+            # 3. Obtener todo lo posterior al horizonte (Agrupado)
+            pipeline_lejanos = [
+                {
+                    "$match": {
+                        "fecha": {"$gt": fecha_corte}
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": "posteriores",
+                        "m2_utilizados": {"$sum": "$m2_utilizados"},
+                        "conteo_pedidos": {"$sum": "$conteo_pedidos"}
+                    }
                 }
-            }
-        ]
-        resultado_lejanos = list(db.reporte_capacidad_diaria.aggregate(pipeline_lejanos))
+            ]
+            resultado_lejanos = await (await db[COLECCION_CONTADORES].aggregate(pipeline_lejanos)).to_list(None)
 
         # 4. Combinar resultados
         data_final = reporte_cercano
 
         if resultado_lejanos:
             agregado = resultado_lejanos[0]
-            m2_total = agregado.get('capacidad_total_m2', 0)
             m2_usados = agregado.get('m2_utilizados', 0)
+            m2_total = m2_usados  # La barra "Posteriores" siempre se muestra llena
             
             # Creamos objeto ficticio para la barra "Posteriores"
             objeto_posteriores = {
@@ -141,165 +435,450 @@ def get_reporte_capacidad():
             }
             data_final.append(objeto_posteriores)
 
-        return JSONResponse(content=jsonable_encoder(data_final))
+        respuesta = RespuestaJSON(content=data_final)
+        guardar_cache(("reporte",), respuesta)
+        return respuesta
 
     except Exception as e:
         logging.error(f"Error en reporte: {e}")
-        return JSONResponse(content=[], status_code=500)
+        return JSONResponse(content=[], status_code=codigo_error(e))
 
 @app.get("/api/pedidos/{fecha_str}") 
-def get_pedidos_por_fecha(fecha_str: str):
+async def get_pedidos_por_fecha(fecha_str: str, formato: str = None):
+    """
+    Pedidos de un día (o de la barra "Posteriores").
+    - formato: (Opcional) ndjson, json, csv o xlsx. Manda los pedidos en streaming
+      (sin caché) en lugar de armar toda la lista en memoria.
+    """
+    if formato and (error := validar_formato(formato)):
+        return error
     try:
-        # Manejo especial para la barra "Posteriores"
-        if fecha_str == "Posteriores":
-            hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            dias_visibles = 5
-            fecha_corte = hoy + timedelta(days=dias_visibles)
+        with pymongo.timeout(DEADLINE_PETICION_S):
+            await revisar_version_datos()
+
+            # Manejo especial para la barra "Posteriores"
+            if fecha_str == "Posteriores":
+                if not formato:
+                    cacheada = leer_cache(("pedidos", "Posteriores"))
+                    if cacheada:
+                        return cacheada
+
+                hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+                dias_visibles = 5
+                fecha_corte = hoy + timedelta(days=dias_visibles)
+                
+                cursor = db.pedidos.find(
+                    {"fecha_programacion_asignada": {"$gt": fecha_corte}}, 
+                    PROYECCION_PEDIDO
+                ).sort([("fecha_programacion_asignada", 1)])
+                if formato:
+                    return respuesta_streaming(cursor, formato, "pedidos_posteriores")
+                respuesta = RespuestaJSON(content=await cursor.to_list(None))
+                guardar_cache(("pedidos", "Posteriores"), respuesta)
+                return respuesta
+
+            try:
+                fecha_obj = datetime.strptime(fecha_str, "%Y-%m-%d")
+            except ValueError:
+                return JSONResponse(content={"error": "Fecha inválida"}, status_code=400)
+
+            fecha_busqueda = datetime.combine(fecha_obj.date(), time.min)
+            if not formato:
+                cacheada = leer_cache(clave_dia(fecha_busqueda))
+                if cacheada:
+                    return cacheada
             
             cursor = db.pedidos.find(
-                {"fecha_programacion_asignada": {"$gt": fecha_corte}}, 
-                {'_id': 0} 
-            ).sort([("fecha_programacion_asignada", 1)])
-            return JSONResponse(content=jsonable_encoder(list(cursor)))
+                {"fecha_programacion_asignada": fecha_busqueda}, 
+                PROYECCION_PEDIDO
+            ).sort([("prioridad", 1), ("FECHA_INGRESO", 1)])
+            if formato:
+                return respuesta_streaming(cursor, formato, f"pedidos_{fecha_busqueda:%Y-%m-%d}")
+            
+            respuesta = RespuestaJSON(content=await cursor.to_list(None))
+            guardar_cache(clave_dia(fecha_busqueda), respuesta)
+            return respuesta
 
-        try:
-            fecha_obj = datetime.strptime(fecha_str, "%Y-%m-%d")
-        except ValueError:
-            return JSONResponse(content={"error": "Fecha inválida"}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"detail": str(e)}, status_code=codigo_error(e))
 
-        fecha_busqueda = datetime.combine(fecha_obj.date(), time.min)
-        
-        cursor = db.pedidos.find(
-            {"fecha_programacion_asignada": fecha_busqueda}, 
-            {'_id': 0} 
-        ).sort([("prioridad", 1), ("FECHA_INGRESO", 1)])
-        
-        return JSONResponse(content=jsonable_encoder(list(cursor)))
+@app.post("/api/simulacion")
+async def simular_programacion_api(payload: SimulacionRequest):
+    """
+    Reporte proyectado si se programaran hoy los pedidos pendientes con otras capacidades,
+    sin algunas OPs, con otras prioridades o con otro umbral de cierre. No escribe en la BD.
+    El snapshot de pendientes, calendario y carga se reutiliza entre simulaciones.
+    """
+    try:
+        capacidades = {datetime.strptime(f, "%Y-%m-%d").date(): cap for f, cap in payload.capacidades.items()}
+    except ValueError:
+        return JSONResponse(content={"error": "Fecha inválida en capacidades"}, status_code=400)
 
+    try:
+        with pymongo.timeout(DEADLINE_PETICION_S):
+            await revisar_version_datos()
+        snapshot = await obtener_snapshot(payload.refrescar)
+
+        inicio = perf_counter()
+        umbral = payload.umbral_cierre if payload.umbral_cierre is not None else UMBRAL_CIERRE_DIA
+        reporte = await run_in_threadpool(
+            simular_programacion, snapshot, capacidades, payload.excluir_ops, payload.prioridades, umbral
+        )
+        return RespuestaJSON(content={
+            "reporte": reporte,
+            "pedidos_pendientes": len(snapshot["pedidos"]),
+            "snapshot": snapshot["creado"],
+            "ms": round((perf_counter() - inicio) * 1000, 1),
+        })
     except Exception as e:
-        return JSONResponse(content={"detail": str(e)}, status_code=500)
+        logging.error(f"Error en simulación: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=codigo_error(e))
+
+def codificar_cursor(doc: dict) -> str:
+    """ Token opaco con la llave de orden (prioridad, OP) del último pedido de la página. """
+    llave = json.dumps({"p": doc.get("prioridad"), "op": doc.get("OP")})
+    return base64.urlsafe_b64encode(llave.encode()).decode()
+
+def decodificar_cursor(token: str) -> dict:
+    llave = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return {"prioridad": llave["p"], "OP": llave["op"]}
+
+def filtro_despues_de(llave: dict) -> dict:
+    """ Pedidos que van después de la llave en el orden (prioridad, OP); los null van primero. """
+    prioridad, op = llave["prioridad"], llave["OP"]
+    mismo_prioridad_mayor_op = {"prioridad": prioridad, "OP": {"$gt": op}}
+    if prioridad is None:
+        return {"$or": [{"prioridad": {"$ne": None}}, mismo_prioridad_mayor_op]}
+    return {"$or": [{"prioridad": {"$gt": prioridad}}, mismo_prioridad_mayor_op]}
+
+async def contar_pedidos(filtro: dict, clave: str) -> int:
+    """
+    Total de coincidencias cacheado por filtro durante TTL_CONTEO_S.
+    Sin filtro se usa el conteo estimado de la colección (metadatos, no recorre documentos).
+    """
+    ahora = monotonic()
+    guardado = CACHE_CONTEOS.get(clave)
+    if guardado and guardado[0] > ahora:
+        return guardado[1]
+
+    if filtro:
+        total = await db.pedidos.count_documents(filtro)
+    else:
+        total = await db.pedidos.estimated_document_count()
+    CACHE_CONTEOS[clave] = (ahora + TTL_CONTEO_S, total)
+    return total
 
 @app.get("/api/todos-los-pedidos")
-def get_all_pedidos(skip: int = 0, limit: int = 1000, buscar: str = None):
+async def get_all_pedidos(skip: int = 0, limit: int = 1000, buscar: str = None,
+                          cursor: str = None, con_total: bool = True, formato: str = None):
     """
     Retorna un listado paginado de pedidos.
     - skip: Cuántos registros saltar (para paginación).
     - limit: Cuántos registros traer (default 1000 para no saturar).
-    - buscar: (Opcional) Filtra por OP o Cliente.
+    - buscar: (Opcional) Filtra por OP o Cliente (prefijo o contiene, sin acentos ni mayúsculas).
+      La coincidencia exacta de OP sale primero y la página se limita a LIMITE_BUSQUEDA.
+    - cursor: (Opcional) Token "siguiente" de la página anterior. Pagina por llave
+      (prioridad, OP) en lugar de skip, así las páginas profundas cuestan lo mismo.
+    - con_total: Si es False no se calcula el total (el conteo se cachea unos segundos).
+    - formato: (Opcional) ndjson, json, csv o xlsx. Exporta en streaming los pedidos del filtro
+      en el mismo orden (limit=0 para todos); no lleva total, "siguiente" ni OP exacta al inicio.
     """
+    if formato and (error := validar_formato(formato)):
+        return error
     try:
         filtro = {}
+        filtro_pagina = {}
         
         # Si el usuario envía un texto para buscar
         if buscar:
-            # Crea una búsqueda insensible a mayúsculas/minúsculas en OP o CLIENTE
-            regex_search = {"$regex": buscar, "$options": "i"}
-            filtro = {
-                "$or": [
-                    {"OP": regex_search},
-                    {"CLIENTE": regex_search}
-                ]
-            }
-
-        # Consulta a la base de datos
-        # Proyectamos {'_id': 0} para evitar errores de serialización
-        cursor = db.pedidos.find(filtro, {'_id': 0})\
-            .sort([("prioridad", 1), ("OP", 1)])\
-            .skip(skip)\
-            .limit(limit)
+            # Prefijo sobre las claves normalizadas que guarda el ETL (usa índice)
+            filtro = filtro_busqueda(buscar)
+            filtro_pagina = filtro
+            if not formato:
+                limit = min(limit, LIMITE_BUSQUEDA)
+                # La OP exacta se antepone en la primera página, las páginas no la repiten
+                filtro_pagina = {"$and": [filtro, {"OP": {"$ne": buscar.strip()}}]}
+
+        if cursor:
+            try:
+                llave = decodificar_cursor(cursor)
+            except (ValueError, KeyError, TypeError):
+                return JSONResponse(content={"error": "Cursor inválido"}, status_code=400)
+            condicion = filtro_despues_de(llave)
+            filtro_pagina = {"$and": [filtro_pagina, condicion]} if filtro_pagina else condicion
+            skip = 0
+
+        if formato:
+            consulta = db.pedidos.find(filtro_pagina, PROYECCION_PEDIDO)\
+                .sort([("prioridad", 1), ("OP", 1)])\
+                .skip(skip)\
+                .limit(limit)
+            return respuesta_streaming(consulta, formato, "pedidos")
+
+        with pymongo.timeout(DEADLINE_LISTADO_S):
+            # Consulta a la base de datos
+            # Sin _id ni claves_busqueda (ver PROYECCION_PEDIDO)
+            consulta = db.pedidos.find(filtro_pagina, PROYECCION_PEDIDO)\
+                .sort([("prioridad", 1), ("OP", 1)])\
+                .skip(skip)\
+                .limit(limit)
+                
+            lista_pedidos = await consulta.to_list(None)
+
+            siguiente = None
+            if lista_pedidos and len(lista_pedidos) == limit:
+                siguiente = codificar_cursor(lista_pedidos[-1])
+
+            # En la primera página la OP exacta va al inicio (índice único de OP)
+            if buscar and not cursor and skip == 0:
+                exacto = await db.pedidos.find_one({"OP": buscar.strip()}, PROYECCION_PEDIDO)
+                if exacto:
+                    lista_pedidos.insert(0, exacto)
             
-        lista_pedidos = list(cursor)
-        
-        # Información extra para saber si hay más datos
-        total_coincidencias = db.pedidos.count_documents(filtro)
+            # Información extra para saber si hay más datos
+            clave_conteo = normalizar_texto(buscar) if buscar else ""
+            total_coincidencias = await contar_pedidos(filtro, clave_conteo) if con_total else None
 
-        return JSONResponse(content={
-            "data": jsonable_encoder(lista_pedidos),
+        return RespuestaJSON(content={
+            "data": lista_pedidos,
             "total": total_coincidencias,
             "skip": skip,
-            "limit": limit
+            "limit": limit,
+            "siguiente": siguiente
         })
 
     except Exception as e:
         logging.error(f"Error obteniendo listado completo: {e}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        return JSONResponse(content={"error": str(e)}, status_code=codigo_error(e))
+
+
+# --- MOTOR DE INTERCAMBIOS ---
+# Sin transacciones (Mongo puede no estar en replica set): la capacidad se aparta con $inc
+# condicionados sobre el contador de cada día que sube de carga, y cada pedido se mueve solo
+# si sigue con la fecha y el M2 que se leyeron. Si algo cambió en medio se deshace lo aplicado
+# y se responde 409 en lugar de sobrecargar el día. Lo que deshace o termina un swap ya
+# empezado corre fuera del deadline de la petición (con su propio presupuesto); si aun así
+# falla, los contadores se reconcilian contra los pedidos en segundo plano.
+async def reservar_capacidad(subidas: dict, apartados: dict):
+    """ $inc condicionado por día (carga + m2 <= límite); anota en `apartados` lo que se aplicó. """
+    for fecha, (m2, conteo) in sorted(subidas.items()):
+        try:
+            # Si el día no cumple la condición el upsert intenta insertarlo y choca con el
+            # índice único fecha_unica; si el día no existía se crea con esta carga
+            await db[COLECCION_CONTADORES].update_one(
+                {"fecha": fecha, "m2_utilizados": {"$lte": LIMITE_CAPACIDAD_CON_TOLERANCIA - m2}},
+                actualizacion_delta(m2, conteo),
+                upsert=True
+            )
+        except DuplicateKeyError:
+            raise ConflictoIntercambio(f"La carga del {fecha:%Y-%m-%d} cambió mientras se aplicaba el cambio.")
+        apartados[fecha] = (m2, conteo)
+
+async def revertir_contadores(deltas: dict):
+    operaciones = operaciones_contadores({fecha: (-m2, -conteo) for fecha, (m2, conteo) in deltas.items()})
+    if operaciones:
+        await db[COLECCION_CONTADORES].bulk_write(operaciones, ordered=False)
+
+async def mover_pedidos(movimientos: list):
+    """
+    Mueve cada pedido a su nueva fecha (CON CANDADO fijo_usuario=True) solo si sigue como se leyó.
+    Si alguno ya había cambiado lanza ConflictoIntercambio (los que sí se movieron los regresa
+    deshacer_movimientos).
+    """
+    operations = [
+        UpdateOne(
+            {"OP": doc["OP"], "fecha_programacion_asignada": doc.get("fecha_programacion_asignada"), "M2": doc.get("M2")},
+            {"$set": {"fecha_programacion_asignada": fecha_nueva, "fijo_usuario": True}}
+        )
+        for doc, fecha_nueva in movimientos
+    ]
+    result = await db.pedidos.bulk_write(operations, ordered=False)
+    if result.matched_count != len(operations):
+        raise ConflictoIntercambio("Otro usuario modificó algunos de los pedidos mientras se aplicaba el cambio.")
+
+async def deshacer_movimientos(movimientos: list):
+    """ Regresa a su fecha anterior los pedidos que sí quedaron en la nueva (con el M2 que se leyó). """
+    actuales = {
+        doc["OP"]: doc
+        for doc in await db.pedidos.find({"OP": {"$in": [doc["OP"] for doc, _ in movimientos]}}).to_list(None)
+    }
+    reversas = []
+    for doc, fecha_nueva in movimientos:
+        actual = actuales.get(doc["OP"], {})
+        if actual.get("fecha_programacion_asignada") == fecha_nueva and actual.get("M2") == doc.get("M2"):
+            previo = {"fecha_programacion_asignada": doc.get("fecha_programacion_asignada")}
+            cambios = {"$set": previo}
+            if "fijo_usuario" in doc:
+                previo["fijo_usuario"] = doc["fijo_usuario"]
+            else:
+                cambios["$unset"] = {"fijo_usuario": ""}
+            reversas.append(UpdateOne({"OP": doc["OP"], "fecha_programacion_asignada": fecha_nueva}, cambios))
+    if reversas:
+        await db.pedidos.bulk_write(reversas, ordered=False)
+
+def reconciliar_contadores():
+    # reconciliar() es síncrona, usamos un cliente de corta vida
+    client_sync = MongoClient(MONGO_URI)
+    try:
+        reconciliar(client_sync[DB_NAME])
+    finally:
+        client_sync.close()
 
+async def reconciliar_en_segundo_plano():
+    try:
+        await run_in_threadpool(reconciliar_contadores)
+    except Exception as e:
+        logging.error(f"No se pudo reconciliar los contadores, queda para la siguiente corrida del scheduler: {e}")
+
+def solicitar_reconciliacion(motivo: str):
+    """ Los contadores pueden haber quedado desviados: se reconcilian sin detener la respuesta. """
+    logging.error(f"{motivo}: se reconcilian los contadores de capacidad.")
+    tarea = asyncio.create_task(reconciliar_en_segundo_plano())
+    TAREAS_RECONCILIACION.add(tarea)
+    tarea.add_done_callback(TAREAS_RECONCILIACION.discard)
+
+async def escribir_fuera_de_deadline(descripcion: str, escritura) -> bool:
+    """
+    Corre `escritura` (deshacer o terminar un swap ya empezado) con DEADLINE_COMPENSACION_S propio.
+    Se llama fuera del `pymongo.timeout` de la petición: un timeout anidado no amplía el de afuera.
+    Si falla se pide la reconciliación y devuelve False.
+    """
+    try:
+        with pymongo.timeout(DEADLINE_COMPENSACION_S):
+            await escritura()
+        return True
+    except Exception as e:
+        solicitar_reconciliacion(f"Falló {descripcion} ({e})")
+        return False
+
+async def aplicar_intercambios(intercambios: list) -> dict:
+    """
+    Aplica uno o varios swaps como una sola unidad: todos o ninguno (si deshacer falla, la
+    reconciliación deja los contadores de acuerdo con los pedidos). Devuelve la carga final
+    de cada día tocado. IntercambioInvalido si algún día rebasaría el límite,
+    ConflictoIntercambio si hubo contención con otro usuario.
+    """
+    apartados = {}
+    movimientos = []
+    escribiendo = moviendo = False
+    try:
+        with pymongo.timeout(DEADLINE_PETICION_S):
+            # 1. Preparar Fechas y OPs (una OP solo puede moverse una vez por lote)
+            destino_por_op = {}
+            for swap in intercambios:
+                fecha_origen_dt = datetime.strptime(swap.fecha_origen, "%Y-%m-%d")
+                fecha_destino_dt = datetime.strptime(swap.fecha_destino, "%Y-%m-%d")
+                for ops, fecha_nueva in ((swap.ops_origen, fecha_destino_dt), (swap.ops_destino, fecha_origen_dt)):
+                    for op in ops:
+                        if op in destino_por_op:
+                            raise IntercambioInvalido(f"La OP {op} aparece más de una vez.")
+                        destino_por_op[op] = fecha_nueva
+
+            # 2. Obtener Documentos de los pedidos involucrados (una sola consulta para todo el lote)
+            docs = await db.pedidos.find(
+                {"OP": {"$in": list(destino_por_op)}},
+                {"_id": 0, "OP": 1, "M2": 1, "fecha_programacion_asignada": 1, "fijo_usuario": 1}
+            ).to_list(None)
+            movimientos = [(doc, destino_por_op[doc["OP"]]) for doc in docs]
+            if not movimientos:
+                raise IntercambioInvalido("No hay OPs para mover")
+
+            deltas = {}
+            for doc, fecha_nueva in movimientos:
+                registrar_cambio(deltas, doc.get("fecha_programacion_asignada"), doc.get("M2"), fecha_nueva, doc.get("M2"))
+
+            # 3. --- VALIDACIÓN CRÍTICA: ESTADO ACTUAL DE LOS DÍAS QUE SUBEN ---
+            contadores = {
+                doc["fecha"]: doc.get("m2_utilizados", 0.0)
+                for doc in await db[COLECCION_CONTADORES].find({"fecha": {"$in": list(deltas)}}).to_list(None)
+            }
+            cargas_finales = {fecha: contadores.get(fecha, 0.0) + m2 for fecha, (m2, _) in deltas.items()}
+            subidas = {fecha: delta for fecha, delta in deltas.items() if delta[0] > 0}
+            for fecha in sorted(subidas):
+                logging.info(f"🛡️ Validación {fecha:%Y-%m-%d}: Actual({contadores.get(fecha, 0.0):.0f}) + Neto({subidas[fecha][0]:.0f}) = Final({cargas_finales[fecha]:.0f})")
+                if cargas_finales[fecha] > LIMITE_CAPACIDAD_CON_TOLERANCIA:
+                    raise IntercambioInvalido(
+                        f"⛔ IMPOSIBLE: El día {fecha:%Y-%m-%d} quedaría con {cargas_finales[fecha]:,.0f} m². "
+                        f"El límite es {LIMITE_CAPACIDAD_CON_TOLERANCIA:,.0f} m²."
+                    )
+
+            # 4. Apartar capacidad y mover pedidos
+            escribiendo = True
+            await reservar_capacidad(subidas, apartados)
+            moviendo = True
+            await mover_pedidos(movimientos)
+    except Exception as e:
+        if escribiendo:
+            # Fuera del deadline de la petición (puede ser justo lo que venció)
+            if moviendo:
+                await escribir_fuera_de_deadline("la reversa de los pedidos", lambda: deshacer_movimientos(movimientos))
+            await escribir_fuera_de_deadline("la reversa de los contadores", lambda: revertir_contadores(apartados))
+            if not isinstance(e, ConflictoIntercambio):
+                # Una escritura sin respuesta pudo haberse aplicado sin quedar en `apartados`
+                solicitar_reconciliacion(f"Swap interrumpido ({e})")
+        raise
+
+    # 5. Descontar de los días que bajan: el swap ya quedó hecho, no depende del deadline
+    bajadas = operaciones_contadores({fecha: delta for fecha, delta in deltas.items() if fecha not in subidas})
+    if bajadas:
+        await escribir_fuera_de_deadline(
+            "el descuento de los días que bajan",
+            lambda: db[COLECCION_CONTADORES].bulk_write(bajadas, ordered=False)
+        )
+
+    # Solo se descartan las vistas de los días tocados (y las agregadas)
+    invalidar_cache([("reporte",), ("pedidos", "Posteriores")] + [clave_dia(f) for f in deltas])
+    descartar_snapshot()
+    with pymongo.timeout(DEADLINE_PETICION_S):
+        await publicar_cambio_datos()
+
+    return {f"{fecha:%Y-%m-%d}": carga for fecha, carga in sorted(cargas_finales.items())}
 
 @app.post("/api/pedidos/intercambiar")
-def intercambiar_pedidos(payload: SwapRequest):
+async def intercambiar_pedidos(payload: SwapRequest):
     logging.info(f"⚡ Swap solicitado: {len(payload.ops_origen)} (Origen) vs {len(payload.ops_destino)} (Destino)")
-    
+    return await ejecutar_intercambios([payload])
+
+@app.post("/api/pedidos/intercambiar-lote")
+async def intercambiar_pedidos_lote(payload: SwapLoteRequest):
+    """ Varios swaps en una sola petición: se aplican todos o ninguno. """
+    logging.info(f"⚡ Lote de {len(payload.intercambios)} swaps solicitado")
+    return await ejecutar_intercambios(payload.intercambios)
+
+async def indice_contadores_listo() -> bool:
+    """ Si al arrancar faltaba el índice único se vuelve a revisar, así basta con crearlo (sin reiniciar). """
+    if not ESTADO_INTERCAMBIOS["indice_unico"]:
+        try:
+            informacion = await db[COLECCION_CONTADORES].index_information()
+            ESTADO_INTERCAMBIOS["indice_unico"] = tiene_indice_unico(informacion, LLAVES_CONTADOR)
+        except PyMongoError as e:
+            logging.error(f"No se pudo revisar el índice de {COLECCION_CONTADORES}: {e}")
+    return ESTADO_INTERCAMBIOS["indice_unico"]
+
+async def ejecutar_intercambios(intercambios: list) -> JSONResponse:
+    if not await indice_contadores_listo():
+        return JSONResponse(
+            content={"success": False, "message": f"Intercambios deshabilitados: falta el índice único de {COLECCION_CONTADORES}."},
+            status_code=503
+        )
     try:
-        # 1. Preparar Fechas
-        fecha_origen_dt = datetime.strptime(payload.fecha_origen, "%Y-%m-%d")
-        fecha_destino_dt = datetime.strptime(payload.fecha_destino, "%Y-%m-%d")
-        fecha_destino_iso = datetime.combine(fecha_destino_dt.date(), time.min)
-
-        # 2. Obtener Documentos de los pedidos involucrados (Calculo Real)
-        pedidos_origen_docs = list(db.pedidos.find({"OP": {"$in": payload.ops_origen}}))
-        pedidos_destino_docs = list(db.pedidos.find({"OP": {"$in": payload.ops_destino}}))
-
-        m2_entrando_a_destino = sum(p.get("M2", 0) for p in pedidos_origen_docs) 
-        m2_saliendo_de_destino = sum(p.get("M2", 0) for p in pedidos_destino_docs)
-
-        # 3. --- VALIDACIÓN CRÍTICA: ESTADO ACTUAL DEL DESTINO ---
-        # Consultamos cuánto tiene cargado el día destino ACTUALMENTE en la base de datos
-        pipeline_carga = [
-            {"$match": {"fecha_programacion_asignada": fecha_destino_iso}},
-            {"$group": {"_id": None, "total_m2": {"$sum": "$M2"}}}
-        ]
-        resultado_carga = list(db.pedidos.aggregate(pipeline_carga))
-        carga_actual_destino = resultado_carga[0]['total_m2'] if resultado_carga else 0.0
-
-        # Cálculo de la proyección final
-        carga_final_proyectada = carga_actual_destino + m2_entrando_a_destino - m2_saliendo_de_destino
-
-        logging.info(f"🛡️ Validación: Actual({carga_actual_destino:.0f}) + Entra({m2_entrando_a_destino:.0f}) - Sale({m2_saliendo_de_destino:.0f}) = Final({carga_final_proyectada:.0f})")
-
-        if carga_final_proyectada > LIMITE_CAPACIDAD_CON_TOLERANCIA:
-            msg = f"⛔ IMPOSIBLE: El día destino quedaría con {carga_final_proyectada:,.0f} m². El límite es {LIMITE_CAPACIDAD_CON_TOLERANCIA:,.0f} m²."
-            return JSONResponse(content={"success": False, "message": msg}, status_code=400)
-
-        # 4. Si pasa la validación, Ejecutar Swap con CANDADO (fijo_usuario=True)
-        operations = []
-        
-        # Mover Origen -> Destino (CON CANDADO)
-        for op in payload.ops_origen:
-            operations.append(UpdateOne(
-                {"OP": op}, 
-                {"$set": {
-                    "fecha_programacion_asignada": fecha_destino_dt,
-                    "fijo_usuario": True 
-                }}
-            ))
-        
-        # Mover Destino -> Origen (CON CANDADO)
-        for op in payload.ops_destino:
-            operations.append(UpdateOne(
-                {"OP": op}, 
-                {"$set": {
-                    "fecha_programacion_asignada": fecha_origen_dt,
-                    "fijo_usuario": True 
-                }}
-            ))
-
-        if operations:
-            db.pedidos.bulk_write(operations)
-            
-            # Recalcular ambas gráficas
-            recalcular_capacidad_dia(fecha_origen_dt)
-            recalcular_capacidad_dia(fecha_destino_dt)
-
-            return JSONResponse(content={
-                "success": True, 
-                "message": f"Cambio exitoso. Destino quedó en {carga_final_proyectada:,.0f} m².",
-            })
-        else:
-            return JSONResponse(content={"success": False, "message": "No hay OPs para mover"}, status_code=400)
+        # El deadline de la petición lo maneja aplicar_intercambios (las reversas van fuera de él)
+        cargas = await aplicar_intercambios(intercambios)
 
+        if len(intercambios) == 1 and intercambios[0].fecha_destino in cargas:
+            mensaje = f"Cambio exitoso. Destino quedó en {cargas[intercambios[0].fecha_destino]:,.0f} m²."
+        else:
+            mensaje = f"Cambio exitoso en {len(cargas)} días."
+        return JSONResponse(content={"success": True, "message": mensaje, "cargas": cargas})
+
+    except IntercambioInvalido as e:
+        return JSONResponse(content={"success": False, "message": str(e)}, status_code=400)
+    except ConflictoIntercambio as e:
+        logging.warning(f"Swap rechazado por contención: {e}")
+        return JSONResponse(content={"success": False, "conflicto": True, "message": f"{e} Intenta de nuevo."}, status_code=409)
     except Exception as e:
         logging.error(traceback.format_exc())
-        return JSONResponse(content={"success": False, "message": str(e)}, status_code=500)
+        return JSONResponse(content={"success": False, "message": str(e)}, status_code=codigo_error(e))
 
 if __name__ == "__main__":
     import uvicorn
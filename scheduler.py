@@ -1,9 +1,16 @@
 import pandas as pd
+import numpy as np
 from pymongo import MongoClient, UpdateOne
 from datetime import datetime, timedelta, date
 import logging
 import sys
 
+from etl import limpiar_op, limpiar_op_serie
+from contadores import (
+    COLECCION_CONTADORES, aplicar_deltas, marcar_datos_actualizados, migrar_contadores, reconciliar, sumar_delta
+)
+from indices import asegurar_indices
+
 # --- CONFIGURACIÓN ---
 MONGO_URI = "mongodb://localhost:27017/"
 DB_NAME = "produccion_db"
@@ -12,6 +19,7 @@ CAPACIDAD_DIARIA_DEFAULT = 180000.00
 UMBRAL_CIERRE_DIA = 165000.00 
 VENTANA_DIAS_ENTREGA = 2 
 DIAS_REPORTE_FUTUROS = 5 
+DIAS_CALENDARIO_PRECALCULADO = 400  # Días naturales que cubre el CalendarioLaboral
 
 # Estatus que consideramos "pendientes" para programar si no tienen fecha
 ESTATUS_A_PROGRAMAR = [
@@ -25,16 +33,6 @@ ESTATUS_A_PROGRAMAR = [
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- HELPERS ---
-def limpiar_op(valor):
-    if pd.isna(valor) or str(valor).strip() == '':
-        return None
-    try:
-        val_float = float(valor)
-        val_int = int(val_float)
-        return str(val_int)
-    except ValueError:
-        return str(valor).strip()
-
 def obtener_db():
     try:
         client = MongoClient(MONGO_URI)
@@ -64,7 +62,8 @@ def obtener_reglas_calendario(db) -> dict:
         return {}
 
 # --- PASO 1: OBTENER SOLO LO NUEVO ---
-def obtener_pedidos_para_programar(db) -> pd.DataFrame:
+def obtener_pedidos_para_programar(db, ops: list = None) -> pd.DataFrame:
+    """ ops: limita la consulta a esas OPs (el servicio de eventos solo pide las que cambiaron). """
     logging.info("Obteniendo pedidos pendientes (sin fecha asignada)...")
     try:
         # El filtro CLAVE: Solo traemos lo que tiene fecha_programacion_asignada: null
@@ -73,6 +72,8 @@ def obtener_pedidos_para_programar(db) -> pd.DataFrame:
             "ESTATUS_EXCEL": {"$in": ESTATUS_A_PROGRAMAR}, 
             "bloqueado": {"$ne": True} 
         }
+        if ops is not None:
+            filtro["OP"] = {"$in": list(ops)}
         proyeccion = {
             "OP": 1, "M2": 1, "FECHA_INGRESO": 1, "FECHA_ENTREGA": 1, "_id": 0, "prioridad": 1 
         }
@@ -83,7 +84,7 @@ def obtener_pedidos_para_programar(db) -> pd.DataFrame:
             df_pedidos['M2'] = pd.to_numeric(df_pedidos['M2'], errors='coerce').fillna(0.0)
             df_pedidos['FECHA_INGRESO'] = pd.to_datetime(df_pedidos['FECHA_INGRESO'])
             df_pedidos['FECHA_ENTREGA'] = pd.to_datetime(df_pedidos['FECHA_ENTREGA'])
-            df_pedidos['OP'] = df_pedidos['OP'].apply(limpiar_op)
+            df_pedidos['OP'] = limpiar_op_serie(df_pedidos['OP'])
             
         logging.info(f"Se encontraron {len(df_pedidos)} pedidos NUEVOS para programar.")
         return df_pedidos
@@ -102,19 +103,19 @@ def obtener_proximo_dia_habil(fecha_actual: date, reglas_calendario: dict) -> da
             if siguiente_dia.weekday() < 5: return siguiente_dia 
         siguiente_dia += timedelta(days=1)
 
-def calcular_dias_reporte(reglas_calendario: dict) -> (list, date):
+def calcular_dias_reporte(calendario) -> (list, date):
     dias_reporte = []
     dia_actual = datetime.now().date()
     
     if dia_actual.weekday() >= 5:
-        dia_actual = obtener_proximo_dia_habil(dia_actual, reglas_calendario)
+        dia_actual = calendario.proximo_dia_habil(dia_actual)
         
     dias_reporte.append(dia_actual)
     while len(dias_reporte) < DIAS_REPORTE_FUTUROS:
-        dia_actual = obtener_proximo_dia_habil(dia_actual, reglas_calendario)
+        dia_actual = calendario.proximo_dia_habil(dia_actual)
         dias_reporte.append(dia_actual)
     
-    fecha_posteriores = obtener_proximo_dia_habil(dias_reporte[-1], reglas_calendario)
+    fecha_posteriores = calendario.proximo_dia_habil(dias_reporte[-1])
     return dias_reporte, fecha_posteriores
 
 def calcular_fecha_limite_entrega(fecha_programacion: date, reglas_calendario: dict) -> date:
@@ -134,209 +135,378 @@ def calcular_fecha_limite_entrega(fecha_programacion: date, reglas_calendario: d
         dias_a_sumar += 1
     return dia_actual
 
+class CalendarioLaboral:
+    """
+    Calendario de días hábiles construido una sola vez con las reglas de obtener_reglas_calendario.
+    Dentro del rango [inicio, inicio + dias_rango) todas las consultas son O(1):
+    - dias: días hábiles en orden (su posición es el ordinal del día)
+    - capacidades / limites_entrega: arreglos paralelos a dias
+    - primer_habil_desde: para cada día natural, ordinal del primer día hábil en o después de él
+    Fuera del rango se usan las funciones de siempre, que avanzan día por día.
+    """
+
+    def __init__(self, reglas_calendario: dict, inicio: date, dias_rango: int = DIAS_CALENDARIO_PRECALCULADO):
+        self.reglas = reglas_calendario
+        self.inicio = inicio
+        self.dias = []
+        self.ordinal = {}
+
+        fechas = [inicio + timedelta(days=offset) for offset in range(dias_rango)]
+        for fecha in fechas:
+            if self.es_laboral(fecha):
+                self.ordinal[fecha] = len(self.dias)
+                self.dias.append(fecha)
+
+        self.primer_habil_desde = [0] * dias_rango
+        siguiente = len(self.dias)
+        for offset in reversed(range(dias_rango)):
+            siguiente = self.ordinal.get(fechas[offset], siguiente)
+            self.primer_habil_desde[offset] = siguiente
+
+        self.capacidades = [self.capacidad(dia) for dia in self.dias]
+        self.limites_entrega = [self.calcular_limite_entrega(dia) for dia in self.dias]
+
+    def es_laboral(self, fecha: date) -> bool:
+        if fecha in self.reglas:
+            return self.reglas[fecha][0]
+        return fecha.weekday() < 5
+
+    def capacidad(self, fecha: date) -> float:
+        regla = self.reglas.get(fecha)
+        return regla[1] if regla else CAPACIDAD_DIARIA_DEFAULT
+
+    def ordinal_siguiente(self, fecha: date):
+        """ Ordinal del primer día hábil estrictamente posterior a `fecha` (None si sale del rango). """
+        offset = (fecha - self.inicio).days + 1
+        if 0 <= offset < len(self.primer_habil_desde):
+            idx = self.primer_habil_desde[offset]
+            if idx < len(self.dias):
+                return idx
+        return None
+
+    def proximo_dia_habil(self, fecha: date) -> date:
+        idx = self.ordinal_siguiente(fecha)
+        if idx is None:
+            return obtener_proximo_dia_habil(fecha, self.reglas)
+        return self.dias[idx]
+
+    def sumar_dias_habiles(self, fecha: date, n: int) -> date:
+        """ El n-ésimo día hábil después de `fecha`. """
+        idx = self.ordinal_siguiente(fecha)
+        if idx is not None and idx + n - 1 < len(self.dias):
+            return self.dias[idx + n - 1]
+        for _ in range(n):
+            fecha = obtener_proximo_dia_habil(fecha, self.reglas)
+        return fecha
+
+    def calcular_limite_entrega(self, fecha_programacion: date) -> date:
+        """ Misma regla que calcular_fecha_limite_entrega, con búsquedas O(1). """
+        if fecha_programacion.weekday() == 4:
+            fecha_limite = fecha_programacion + timedelta(days=4)
+            if fecha_limite in self.reglas and not self.reglas[fecha_limite][0]:
+                fecha_limite = self.proximo_dia_habil(fecha_limite)
+            return fecha_limite
+        return self.sumar_dias_habiles(fecha_programacion, VENTANA_DIAS_ENTREGA)
+
+    def fecha_limite_entrega(self, fecha_programacion: date) -> date:
+        idx = self.ordinal.get(fecha_programacion)
+        if idx is not None:
+            return self.limites_entrega[idx]
+        return self.calcular_limite_entrega(fecha_programacion)
+
 # --- PASO 2: CALCULAR CARGA EXISTENTE (RESPETAR AL USUARIO) ---
+def agregar_carga_programada(db, dias_reporte) -> dict:
+    """
+    Una sola agregación en Mongo sobre los pedidos ya programados desde el primer día del reporte:
+    M2 y conteo agrupados por día, con todo lo posterior al horizonte en un solo grupo "posteriores".
+    """
+    inicio_horizonte = datetime.combine(dias_reporte[0], datetime.min.time())
+    fin_horizonte = datetime.combine(dias_reporte[-1], datetime.max.time())
+    fecha = "$fecha_programacion_asignada"
+    pipeline = [
+        # Cubierta por el índice parcial programados_m2
+        {"$match": {"fecha_programacion_asignada": {"$type": "date", "$gte": inicio_horizonte}}},
+        {"$group": {
+            "_id": {"$cond": [
+                {"$gt": [fecha, fin_horizonte]},
+                "posteriores",
+                {"$dateFromParts": {"year": {"$year": fecha}, "month": {"$month": fecha}, "day": {"$dayOfMonth": fecha}}}
+            ]},
+            "total_m2": {"$sum": "$M2"},
+            "conteo": {"$sum": 1}
+        }}
+    ]
+    return {doc["_id"]: doc for doc in db.pedidos.aggregate(pipeline)}
+
 def calcular_carga_previa(db, dias_reporte, fecha_posteriores):
     """
-    Suma los M2 de pedidos que YA tienen fecha asignada en la BD.
+    Suma los M2 (y cuenta los pedidos) que YA tienen fecha asignada en la BD.
     Esto incluye lo que el usuario movió manualmente (candados) y lo que ya se programó antes.
     """
     logging.info("Calculando carga ocupada por pedidos existentes...")
     capacidad_usada = {dia: 0.0 for dia in dias_reporte}
     capacidad_usada[fecha_posteriores] = 0.0
-    
-    # Buscamos todo lo que NO es nulo en fecha
-    cursor = db.pedidos.find(
-        {"fecha_programacion_asignada": {"$ne": None}}, 
-        {"fecha_programacion_asignada": 1, "M2": 1}
-    )
-    
-    for doc in cursor:
-        fecha = doc.get("fecha_programacion_asignada")
-        m2 = doc.get("M2", 0.0)
-        
-        if isinstance(fecha, datetime):
-            fecha_date = fecha.date()
-            if fecha_date in capacidad_usada:
-                capacidad_usada[fecha_date] += m2
-            elif fecha_date > dias_reporte[-1]:
-                capacidad_usada[fecha_posteriores] += m2
+    conteo_por_dia = {dia: 0 for dia in capacidad_usada}
+
+    for clave, grupo in agregar_carga_programada(db, dias_reporte).items():
+        dia = fecha_posteriores if clave == "posteriores" else clave.date()
+        if dia in capacidad_usada:
+            capacidad_usada[dia] += grupo["total_m2"]
+            conteo_por_dia[dia] += grupo["conteo"]
                 
-    return capacidad_usada
+    return capacidad_usada, conteo_por_dia
 
 # --- PASO 3: MOTOR DE PROGRAMACIÓN INTELIGENTE ---
-def ejecutar_motor_programacion(db, df_pedidos, reglas_calendario):
-    logging.info("Iniciando motor de programación...")
-    dias_reporte, fecha_posteriores = calcular_dias_reporte(reglas_calendario)
+def asignar_pedidos(df_pedidos, calendario, dias_reporte, fecha_posteriores, capacidad_usada_por_dia: dict,
+                    umbral_cierre: float = UMBRAL_CIERRE_DIA) -> dict:
+    """
+    Asigna cada pedido (en el orden del DataFrame) al primer día del horizonte, desde el día
+    de programación actual, cuya fecha límite cubra su FECHA_ENTREGA y que tenga capacidad.
+    Lo que no cabe se va a fecha_posteriores. Actualiza capacidad_usada_por_dia.
+
+    Trabaja sobre arreglos: los días del horizonte son las posiciones 0..n-1 y n es "Posteriores".
+    Los días que ya no aceptan ni al pedido restante más chico se cierran en un union-find
+    ("siguiente día con espacio"), así cada pedido se coloca sin recorrer días llenos.
+    """
+    n = len(dias_reporte)
+    capacidades = [calendario.capacidad(dia) for dia in dias_reporte]
+    usado = [capacidad_usada_por_dia.get(dia, 0) for dia in dias_reporte + [fecha_posteriores]]
+    limites = np.array([calendario.fecha_limite_entrega(dia) for dia in dias_reporte], dtype='datetime64[D]')
+
+    # Avanzamos el día actual si ya está lleno por movimientos manuales previos
+    dia_actual = 0
+    while dia_actual < n and usado[dia_actual] >= umbral_cierre:
+        logging.info(f"Día {dias_reporte[dia_actual]} ya saturado ({usado[dia_actual]:,.0f} m²). Buscando hueco en siguiente día...")
+        dia_actual += 1
+
     actualizaciones_fechas = {}
+    if df_pedidos.empty:
+        return actualizaciones_fechas
+
+    ops = df_pedidos['OP'].tolist()
+    m2s = df_pedidos['M2'].to_numpy(dtype=float)
+    entregas = df_pedidos['FECHA_ENTREGA'].to_numpy().astype('datetime64[D]')
+
+    # elegible[i][j]: el día j cumple la fecha de entrega del pedido i (Business Logic)
+    elegible = (entregas[:, None] <= limites[None, :]).tolist()
+    # minimo_restante[i]: M2 más chico del pedido i en adelante (para cerrar días sin espacio)
+    minimo_restante = np.minimum.accumulate(m2s[::-1])[::-1].tolist()
+    # Con M2 negativos un día lleno podría volver a tener espacio: no se cierran días
+    usar_cierres = bool((m2s >= 0).all())
+    m2s = m2s.tolist()
+
+    siguiente = list(range(n + 1))  # union-find: día j -> siguiente día no cerrado (n nunca se cierra)
+
+    def buscar(j):
+        raiz = j
+        while siguiente[raiz] != raiz:
+            raiz = siguiente[raiz]
+        while siguiente[j] != raiz:
+            siguiente[j], j = raiz, siguiente[j]
+        return raiz
+
+    for i, m2 in enumerate(m2s):
+        elegible_i = elegible[i]
+        j = buscar(dia_actual)
+        while j < n:
+            if elegible_i[j]:
+                # Validar capacidad (Respetando lo manual)
+                if usado[j] + m2 <= capacidades[j]:
+                    break
+                if usar_cierres and usado[j] + minimo_restante[i] > capacidades[j]:
+                    siguiente[j] = j + 1
+            j = buscar(j + 1)
+
+        actualizaciones_fechas[ops[i]] = dias_reporte[j] if j < n else fecha_posteriores
+        usado[j] += m2
+
+        # Si llenamos el día actual con automáticos, avanzamos
+        if j == dia_actual and j != n and usado[j] >= umbral_cierre:
+            dia_actual += 1
+
+    for j, dia in enumerate(dias_reporte + [fecha_posteriores]):
+        capacidad_usada_por_dia[dia] = usado[j]
+    return actualizaciones_fechas
+
+def ejecutar_motor_programacion(db, df_pedidos, calendario, umbral_cierre: float = UMBRAL_CIERRE_DIA,
+                                carga_previa: tuple = None, horizonte: tuple = None):
+    """
+    carga_previa: (capacidad_usada, conteo_por_dia) ya calculados (ver cargar_snapshot);
+    con ella el motor no consulta la BD y no modifica los diccionarios recibidos.
+    horizonte: (dias_reporte, fecha_posteriores) con los que se calculó carga_previa; sin él
+    se calcula a partir de hoy.
+    """
+    logging.info("Iniciando motor de programación...")
+    dias_reporte, fecha_posteriores = horizonte or calcular_dias_reporte(calendario)
     
     # AQUI ESTA LA MAGIA: Iniciamos con el vaso medio lleno, no vacío
-    capacidad_usada_por_dia = calcular_carga_previa(db, dias_reporte, fecha_posteriores)
-    
-    dia_programacion_actual = dias_reporte[0]
-
-    # Avanzamos el día actual si ya está lleno por movimientos manuales previos
-    while True:
-        if dia_programacion_actual == fecha_posteriores: break
-        
-        regla = reglas_calendario.get(dia_programacion_actual)
-        cap_total = regla[1] if regla else CAPACIDAD_DIARIA_DEFAULT
-        usado = capacidad_usada_por_dia.get(dia_programacion_actual, 0)
-        
-        if usado >= UMBRAL_CIERRE_DIA:
-            logging.info(f"Día {dia_programacion_actual} ya saturado ({usado:,.0f} m²). Buscando hueco en siguiente día...")
-            nuevo_dia = obtener_proximo_dia_habil(dia_programacion_actual, reglas_calendario)
-            if nuevo_dia not in dias_reporte:
-                dia_programacion_actual = fecha_posteriores
-                break
-            dia_programacion_actual = nuevo_dia
-        else:
-            break
+    if carga_previa is None:
+        capacidad_usada_por_dia, conteo_por_dia = calcular_carga_previa(db, dias_reporte, fecha_posteriores)
+    else:
+        capacidad_usada_por_dia, conteo_por_dia = dict(carga_previa[0]), dict(carga_previa[1])
 
     # Asignamos los pedidos NUEVOS en los huecos libres
-    for _, pedido in df_pedidos.iterrows():
-        op = pedido['OP'] 
-        m2 = pedido['M2'] 
-        
-        dia_asignado = None
-        dia_a_probar = dia_programacion_actual
-        
-        while True: 
-            # Si llegamos a posteriores, ahí se queda
-            if dia_a_probar == fecha_posteriores:
-                dia_asignado = fecha_posteriores
-                break
-                
-            regla_dia = reglas_calendario.get(dia_a_probar)
-            capacidad_dia = regla_dia[1] if regla_dia else CAPACIDAD_DIARIA_DEFAULT
-            uso_actual_dia = capacidad_usada_por_dia.get(dia_a_probar, 0)
-            
-            # Validar fecha entrega (Business Logic)
-            fecha_limite_ent = calcular_fecha_limite_entrega(dia_a_probar, reglas_calendario)
-            if pedido['FECHA_ENTREGA'].date() > fecha_limite_ent:
-                dia_a_probar = obtener_proximo_dia_habil(dia_a_probar, reglas_calendario)
-                if dia_a_probar not in dias_reporte: dia_a_probar = fecha_posteriores
-                continue 
-            
-            # Validar capacidad (Respetando lo manual)
-            if (uso_actual_dia + m2) <= capacidad_dia:
-                dia_asignado = dia_a_probar
-                break 
-            else:
-                dia_a_probar = obtener_proximo_dia_habil(dia_a_probar, reglas_calendario)
-                if dia_a_probar not in dias_reporte: dia_a_probar = fecha_posteriores
-                continue 
-        
-        actualizaciones_fechas[op] = dia_asignado
-        capacidad_usada_por_dia[dia_asignado] += m2
+    actualizaciones_fechas = asignar_pedidos(
+        df_pedidos, calendario, dias_reporte, fecha_posteriores, capacidad_usada_por_dia, umbral_cierre
+    )
+    for dia in actualizaciones_fechas.values():
+        conteo_por_dia[dia] = conteo_por_dia.get(dia, 0) + 1
+    return actualizaciones_fechas, capacidad_usada_por_dia, conteo_por_dia, dias_reporte, fecha_posteriores
 
-        # Si llenamos el día actual con automáticos, avanzamos
-        if dia_asignado == dia_programacion_actual and dia_asignado != fecha_posteriores:
-             if capacidad_usada_por_dia[dia_asignado] >= UMBRAL_CIERRE_DIA:
-                nuevo_dia = obtener_proximo_dia_habil(dia_asignado, reglas_calendario)
-                if nuevo_dia in dias_reporte:
-                    dia_programacion_actual = nuevo_dia
-                else:
-                    dia_programacion_actual = fecha_posteriores
-
-    return actualizaciones_fechas, capacidad_usada_por_dia, dias_reporte, fecha_posteriores
-
-def actualizar_base_datos(db, actualizaciones_fechas: dict):
-    if not actualizaciones_fechas: return
+def actualizar_base_datos(db, actualizaciones_fechas: dict, m2_por_op: dict) -> int:
+    """
+    Escribe las fechas asignadas (solo a los pedidos que siguen sin fecha) y devuelve cuántos
+    pedidos se modificaron. Si son menos que los asignados, los contadores ya se reconciliaron
+    pero quien programó sobre una carga en memoria la tiene que releer.
+    """
+    if not actualizaciones_fechas: return 0
     logging.info(f"Guardando fechas de {len(actualizaciones_fechas)} pedidos nuevos...")
     try:
         operations = []
+        deltas = {}
         for op, fecha_date in actualizaciones_fechas.items():
             fecha_iso = datetime.combine(fecha_date, datetime.min.time())
             op_limpia = limpiar_op(op)
-            # Solo actualizamos la fecha, NO ponemos candado (fijo_usuario) porque es automático
-            operations.append(UpdateOne({"OP": op_limpia}, {"$set": {"fecha_programacion_asignada": fecha_iso}}))
+            # Solo actualizamos la fecha, NO ponemos candado (fijo_usuario) porque es automático.
+            # Si el usuario le asignó fecha mientras corría el motor, se respeta la suya.
+            operations.append(UpdateOne(
+                {"OP": op_limpia, "fecha_programacion_asignada": None},
+                {"$set": {"fecha_programacion_asignada": fecha_iso}}
+            ))
+            sumar_delta(deltas, fecha_iso, m2_por_op.get(op, 0.0), 1)
         
         if operations:
             result = db.pedidos.bulk_write(operations)
+            aplicar_deltas(db, deltas)
             logging.info(f"Fechas asignadas automáticamente: {result.modified_count}")
+            if result.modified_count != len(operations):
+                # Algunos pedidos cambiaron entre la lectura y la escritura: los contadores se corrigen
+                logging.warning("Hubo pedidos que ya no estaban pendientes, reconciliando contadores...")
+                reconciliar(db)
+            return result.modified_count
+        return 0
     except Exception as e:
         logging.error(f"Error al actualizar MongoDB: {e}")
         raise 
 
-def actualizar_reporte_capacidad(db, reglas_calendario, capacidad_usada, dias_reporte, fecha_posteriores):
-    logging.info("Regenerando reporte de capacidad (agregando lo manual + automático)...")
+def asegurar_dias_reporte(db, calendario, dias_reporte):
+    """
+    Los contadores por día se mantienen con $inc desde cada escritura (ver contadores.py);
+    aquí solo se asegura que los días del horizonte existan (aunque tengan 0 pedidos)
+    con la capacidad del calendario. Un día nuevo se crea en 0 aunque ya tenga pedidos:
+    quien lo llama reconcilia después.
+    """
+    operations = [
+        UpdateOne(
+            {"fecha": datetime.combine(fecha, datetime.min.time())},
+            {"$set": {"capacidad_total_m2": calendario.capacidad(fecha)},
+             "$setOnInsert": {"m2_utilizados": 0.0, "conteo_pedidos": 0}},
+            upsert=True
+        )
+        for fecha in dias_reporte
+    ]
     try:
-        db.reporte_capacidad_diaria.delete_many({})
-        datos_reporte = []
-        
-        # Hacemos una agregación DIRECTA en base de datos para tener la verdad absoluta
-        # (Suma lo que acabamos de guardar + lo que ya existía)
-        for fecha in dias_reporte:
-            regla = reglas_calendario.get(fecha)
-            cap_total = regla[1] if regla else CAPACIDAD_DIARIA_DEFAULT
-            
-            fecha_iso = datetime.combine(fecha, datetime.min.time())
-            
-            pipeline = [
-                {"$match": {"fecha_programacion_asignada": fecha_iso}},
-                {"$group": {"_id": None, "total_m2": {"$sum": "$M2"}, "conteo": {"$sum": 1}}}
-            ]
-            res = list(db.pedidos.aggregate(pipeline))
-            m2_reales = res[0]['total_m2'] if res else 0.0
-            conteo = res[0]['conteo'] if res else 0
-            
-            datos_reporte.append({
-                "fecha": fecha_iso, 
-                "capacidad_total_m2": cap_total, 
-                "m2_utilizados": m2_reales, 
-                "m2_disponibles": cap_total - m2_reales, 
-                "conteo_pedidos": conteo
-            })
-            
-        # Calcular "Posteriores" (Todo lo que cae después del horizonte visible)
-        fecha_limite_horizonte = datetime.combine(dias_reporte[-1], datetime.max.time())
-        
-        pipeline_post = [
-             {"$match": {"fecha_programacion_asignada": {"$gt": fecha_limite_horizonte}}},
-             {"$group": {"_id": None, "total_m2": {"$sum": "$M2"}, "conteo": {"$sum": 1}}}
-        ]
-        res_post = list(db.pedidos.aggregate(pipeline_post))
-        m2_post = res_post[0]['total_m2'] if res_post else 0.0
-        conteo_post = res_post[0]['conteo'] if res_post else 0
-        
-        if m2_post > 0:
-            # Guardamos "Posteriores" con la fecha real del objeto fecha_posteriores
-            # El backend (main.py) se encargará de agruparlo visualmente si es necesario
-            fecha_post_obj = datetime.combine(fecha_posteriores, datetime.min.time())
-            
-            datos_reporte.append({
-                "fecha": fecha_post_obj, 
-                "capacidad_total_m2": m2_post, 
-                "m2_utilizados": m2_post, 
-                "m2_disponibles": 0.0, 
-                "conteo_pedidos": conteo_post
-            })
-
-        if datos_reporte:
-            db.reporte_capacidad_diaria.insert_many(datos_reporte)
-        logging.info("Reporte actualizado correctamente.")
+        db[COLECCION_CONTADORES].bulk_write(operations, ordered=False)
     except Exception as e:
         logging.error(f"Error al actualizar el reporte: {e}")
         raise 
 
+# --- SIMULACIÓN (QUÉ PASARÍA SI...) ---
+def cargar_snapshot(db) -> dict:
+    """
+    Todo lo que el motor lee de la BD, para simular varias veces sin volver a consultarla.
+    Guarda el horizonte con el que se calculó la carga: la simulación usa ese y no el de la
+    hora en que corre (el snapshot puede cruzar la medianoche).
+    """
+    reglas_calendario = obtener_reglas_calendario(db)
+    calendario = CalendarioLaboral(reglas_calendario, datetime.now().date())
+    dias_reporte, fecha_posteriores = calcular_dias_reporte(calendario)
+    return {
+        "reglas": reglas_calendario,
+        "pedidos": obtener_pedidos_para_programar(db),
+        "carga_previa": calcular_carga_previa(db, dias_reporte, fecha_posteriores),
+        "dias_reporte": dias_reporte,
+        "fecha_posteriores": fecha_posteriores,
+        "creado": datetime.now(),
+    }
+
+def simular_programacion(snapshot: dict, capacidades: dict = None, excluir_ops: list = None,
+                         prioridades: dict = None, umbral_cierre: float = UMBRAL_CIERRE_DIA) -> list:
+    """
+    Corre el motor sobre el snapshot con cambios hipotéticos y devuelve el reporte proyectado
+    por día (más "Posteriores"), sin escribir nada en la BD.
+    - capacidades: {date: m2} reemplaza la capacidad del calendario de esos días
+    - excluir_ops: OPs que no se programan
+    - prioridades: {OP: prioridad} nueva prioridad de esas OPs (cambia el orden de asignación)
+    """
+    reglas = dict(snapshot["reglas"])
+    for fecha, capacidad in (capacidades or {}).items():
+        es_laboral = reglas[fecha][0] if fecha in reglas else fecha.weekday() < 5
+        reglas[fecha] = (es_laboral, float(capacidad))
+    calendario = CalendarioLaboral(reglas, snapshot["creado"].date())
+
+    df_pedidos = snapshot["pedidos"]
+    if not df_pedidos.empty:
+        if excluir_ops:
+            df_pedidos = df_pedidos[~df_pedidos['OP'].isin(list(excluir_ops))]
+        if prioridades:
+            # Los pedidos sin campo prioridad (lo normal) no traen la columna
+            actuales = df_pedidos.get('prioridad', pd.Series(np.nan, index=df_pedidos.index))
+            df_pedidos = df_pedidos.assign(prioridad=df_pedidos['OP'].map(prioridades).fillna(actuales))
+            # Mismo orden que la consulta de pendientes (los null primero, como en Mongo)
+            df_pedidos = df_pedidos.sort_values(['prioridad', 'FECHA_INGRESO'], na_position='first', kind='stable')
+
+    actualizaciones, capacidad_usada, conteos, dias_reporte, fecha_posteriores = ejecutar_motor_programacion(
+        None, df_pedidos, calendario, umbral_cierre, carga_previa=snapshot["carga_previa"],
+        horizonte=(snapshot["dias_reporte"], snapshot["fecha_posteriores"])
+    )
+
+    reporte = []
+    for fecha in dias_reporte:
+        cap_total = calendario.capacidad(fecha)
+        m2_reales = capacidad_usada.get(fecha, 0.0)
+        reporte.append({
+            "fecha": fecha.isoformat(),
+            "capacidad_total_m2": cap_total,
+            "m2_utilizados": m2_reales,
+            "m2_disponibles": cap_total - m2_reales,
+            "conteo_pedidos": conteos.get(fecha, 0),
+        })
+    m2_post = capacidad_usada.get(fecha_posteriores, 0.0)
+    reporte.append({
+        "fecha": "Posteriores",
+        "capacidad_total_m2": m2_post,
+        "m2_utilizados": m2_post,
+        "m2_disponibles": 0.0,
+        "conteo_pedidos": conteos.get(fecha_posteriores, 0),
+    })
+    return reporte
+
 def main():
     logging.info("--- Iniciando Scheduler Inteligente (Modo Respeto) ---")
     db = obtener_db()
     try:
+        asegurar_indices(db)
+        migrar_contadores(db)
         reglas_calendario = obtener_reglas_calendario(db)
+        calendario = CalendarioLaboral(reglas_calendario, datetime.now().date())
         
         # 1. Obtener SOLO lo que NO tiene fecha (Pedidos Nuevos)
         df_pedidos = obtener_pedidos_para_programar(db)
         
-        # 2. Ejecutar motor (Pasamos df vacio si no hay nuevos, solo para recalcular reporte)
-        actualizaciones, capacidad_usada, dias_rep, fecha_post = ejecutar_motor_programacion(db, df_pedidos, reglas_calendario)
+        # 2. Ejecutar motor (Pasamos df vacio si no hay nuevos)
+        actualizaciones, _, _, dias_rep, _ = ejecutar_motor_programacion(db, df_pedidos, calendario)
             
-        # 3. Guardar fechas de pedidos nuevos
+        # 3. Guardar fechas de pedidos nuevos (y sus $inc en los contadores por día)
         if not df_pedidos.empty:
-            actualizar_base_datos(db, actualizaciones)
+            actualizar_base_datos(db, actualizaciones, dict(zip(df_pedidos['OP'], df_pedidos['M2'])))
         
-        # 4. Regenerar reporte final
-        actualizar_reporte_capacidad(db, reglas_calendario, capacidad_usada, dias_rep, fecha_post)
+        # 4. Días del horizonte visibles en el reporte aunque estén vacíos
+        asegurar_dias_reporte(db, calendario, dias_rep)
+        # 5. Los contadores contra la suma real: repara días creados en 0 que ya tenían pedidos
+        #    y cualquier $inc que se haya perdido desde la última corrida
+        reconciliar(db)
+        marcar_datos_actualizados(db)
             
         logging.info("¡Scheduler finalizado!")
     except Exception as e:
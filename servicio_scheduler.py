@@ -0,0 +1,235 @@
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+from datetime import datetime
+from time import monotonic
+import argparse
+import logging
+import time
+
+from contadores import COLECCION_METADATOS, marcar_datos_actualizados, migrar_contadores, reconciliar
+from indices import asegurar_indices
+from scheduler import (
+    CalendarioLaboral, actualizar_base_datos, asegurar_dias_reporte, asignar_pedidos, calcular_carga_previa,
+    calcular_dias_reporte, obtener_pedidos_para_programar, obtener_reglas_calendario
+)
+
+# Scheduler como servicio: en lugar de volver a correr scheduler.py completo, escucha el
+# change stream de pedidos y programa solo las OPs nuevas o que cambiaron de estatus,
+# con la carga por día en memoria. Si Mongo no es replica set (sin change streams)
+# revisa los pendientes cada INTERVALO_POLLING_S. Los contadores de capacidad se
+# reconcilian al arrancar, al cambiar de día y cada INTERVALO_RECONCILIACION_S.
+# Uso: python servicio_scheduler.py [--polling]
+
+# --- CONFIGURACIÓN ---
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = "produccion_db"
+
+DEBOUNCE_S = 2.0              # Se programa cuando pasan estos segundos sin eventos nuevos...
+MAX_ESPERA_S = 15.0           # ...o cuando la ráfaga (ej. una carga del ETL) ya lleva este tiempo
+ESPERA_EVENTO_S = 0.5         # Espera máxima de cada lectura del change stream
+INTERVALO_POLLING_S = 10.0    # Modo sin change streams
+RECARGA_CARGA_S = 300.0       # La carga en memoria se vuelve a leer de la BD al menos con esta frecuencia
+REINTENTO_S = 5.0             # Pausa antes de reabrir el change stream tras un error
+INTERVALO_RECONCILIACION_S = 3600.0   # Contadores de capacidad contra la suma real de los pedidos
+ID_TOKEN_REANUDACION = "scheduler_resume_token"
+
+# Solo interesan altas y cambios en los campos que deciden si un pedido se programa o cuánto pesa
+CAMPOS_RELEVANTES = ["ESTATUS_EXCEL", "fecha_programacion_asignada", "bloqueado", "M2"]
+PIPELINE_CAMBIOS = [{"$match": {"$or": [
+    {"operationType": {"$in": ["insert", "replace"]}},
+    {"operationType": "update", "$or": [
+        {f"updateDescription.updatedFields.{campo}": {"$exists": True}} for campo in CAMPOS_RELEVANTES
+    ]},
+]}}]
+
+CODIGO_SIN_REPLICA_SET = 40573
+CODIGO_HISTORIAL_PERDIDO = 286
+
+
+class ServicioScheduler:
+    """
+    Estado del servicio: calendario y carga por día del horizonte en memoria, OPs por programar
+    acumuladas entre eventos y las OPs que el propio servicio acaba de escribir (para ignorar
+    el eco de sus propias actualizaciones en el change stream).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pendientes = set()
+        self.propios = set()
+        self.carga_sucia = True
+        self.cargado_en = 0.0
+        self.reconciliado_en = None
+        self.dia = None
+
+    # --- CARGA EN MEMORIA ---
+    def preparar_carga(self):
+        """ Relee calendario y carga si cambió el día, si otro proceso movió pedidos o si ya caducó. """
+        hoy = datetime.now().date()
+        if not self.carga_sucia and self.dia == hoy and monotonic() - self.cargado_en < RECARGA_CARGA_S:
+            return
+        self.calendario = CalendarioLaboral(obtener_reglas_calendario(self.db), hoy)
+        self.dias_reporte, self.fecha_posteriores = calcular_dias_reporte(self.calendario)
+        if self.dia != hoy:
+            asegurar_dias_reporte(self.db, self.calendario, self.dias_reporte)
+            # Los días recién creados entran en 0 aunque ya tengan pedidos
+            self.reconciliar()
+        self.capacidad_usada, _ = calcular_carga_previa(self.db, self.dias_reporte, self.fecha_posteriores)
+        self.dia = hoy
+        self.carga_sucia = False
+        self.cargado_en = monotonic()
+
+    def programar(self, ops: list = None) -> int:
+        """ Programa los pendientes (solo `ops` si se indican) sobre la carga en memoria. """
+        df_pedidos = obtener_pedidos_para_programar(self.db, ops)
+        if df_pedidos.empty:
+            return 0
+        self.preparar_carga()
+
+        actualizaciones = asignar_pedidos(
+            df_pedidos, self.calendario, self.dias_reporte, self.fecha_posteriores, self.capacidad_usada
+        )
+        self.propios.update(actualizaciones)
+        modificados = actualizar_base_datos(self.db, actualizaciones, dict(zip(df_pedidos['OP'], df_pedidos['M2'])))
+        if modificados != len(actualizaciones):
+            # Otro proceso les puso fecha en medio: capacidad_usada ya sumó pedidos que no se
+            # escribieron y de esos no llegará eco. Se relee todo antes de la siguiente programación
+            logging.warning(f"Solo {modificados} de {len(actualizaciones)} pedidos se escribieron, se relee la carga.")
+            self.propios.difference_update(actualizaciones)
+            self.carga_sucia = True
+        # El dashboard descarta su caché y muestra las OPs nuevas
+        marcar_datos_actualizados(self.db)
+        return len(actualizaciones)
+
+    def reconciliar(self):
+        """ Repara los contadores contra la suma real; si había desviación la carga en memoria se relee. """
+        if reconciliar(self.db):
+            self.carga_sucia = True
+        self.reconciliado_en = monotonic()
+
+    def reconciliar_si_toca(self):
+        if self.reconciliado_en is None or monotonic() - self.reconciliado_en >= INTERVALO_RECONCILIACION_S:
+            self.reconciliar()
+
+    # --- EVENTOS ---
+    def procesar_evento(self, cambio: dict):
+        doc = cambio.get("fullDocument") or {}
+        op = doc.get("OP")
+        if op is None:
+            return
+
+        if cambio["operationType"] == "update":
+            descripcion = cambio.get("updateDescription", {})
+            campos = set(descripcion.get("updatedFields", {})) | set(descripcion.get("removedFields", []))
+        else:
+            campos = set(CAMPOS_RELEVANTES)
+
+        if campos == {"fecha_programacion_asignada"} and op in self.propios:
+            # Eco de lo que este servicio acaba de programar
+            self.propios.discard(op)
+            return
+        if doc.get("fecha_programacion_asignada") is None:
+            self.pendientes.add(op)
+        if "fecha_programacion_asignada" in campos or ("M2" in campos and doc.get("fecha_programacion_asignada")):
+            # Swap, reprogramación o M2 de un pedido programado: la carga en memoria ya no cuadra
+            self.carga_sucia = True
+
+    def vaciar_pendientes(self):
+        ops = sorted(self.pendientes)
+        self.pendientes.clear()
+        programados = self.programar(ops)
+        logging.info(f"{len(ops)} OPs con cambios, {programados} programadas.")
+
+    # --- TOKEN DE REANUDACIÓN ---
+    def leer_token(self):
+        doc = self.db[COLECCION_METADATOS].find_one({"_id": ID_TOKEN_REANUDACION})
+        return doc.get("token") if doc else None
+
+    def guardar_token(self, token):
+        if token is not None:
+            self.db[COLECCION_METADATOS].update_one(
+                {"_id": ID_TOKEN_REANUDACION}, {"$set": {"token": token}}, upsert=True
+            )
+
+    # --- BUCLES ---
+    def escuchar(self):
+        token = self.leer_token()
+        with self.db.pedidos.watch(
+            PIPELINE_CAMBIOS, full_document="updateLookup", resume_after=token,
+            max_await_time_ms=int(ESPERA_EVENTO_S * 1000)
+        ) as stream:
+            logging.info("Escuchando cambios en pedidos...")
+            if token is None:
+                # Sin token no sabemos qué pasó mientras el servicio estaba abajo:
+                # el stream ya está abierto, así que programar todo lo pendiente no pierde nada
+                self.programar()
+                self.guardar_token(stream.resume_token)
+
+            primero = ultimo = None
+            while stream.alive:
+                cambio = stream.try_next()
+                ahora = monotonic()
+                if cambio is not None:
+                    self.procesar_evento(cambio)
+                    ultimo = ahora
+                    if self.pendientes and primero is None:
+                        primero = ahora
+
+                if self.pendientes and (ahora - ultimo >= DEBOUNCE_S or ahora - primero >= MAX_ESPERA_S):
+                    self.vaciar_pendientes()
+                    self.guardar_token(stream.resume_token)
+                    primero = None
+                elif not self.pendientes:
+                    self.reconciliar_si_toca()
+
+    def sondear(self):
+        logging.info(f"Modo polling: revisando pendientes cada {INTERVALO_POLLING_S:.0f} s...")
+        while True:
+            # Sin eventos no nos enteramos de swaps: la carga se relee antes de programar
+            self.carga_sucia = True
+            self.reconciliar_si_toca()
+            programados = self.programar()
+            if programados:
+                logging.info(f"{programados} OPs programadas.")
+            time.sleep(INTERVALO_POLLING_S)
+
+    def correr(self, polling: bool = False):
+        if polling:
+            return self.sondear()
+        while True:
+            try:
+                self.escuchar()
+            except OperationFailure as e:
+                if e.code == CODIGO_SIN_REPLICA_SET:
+                    logging.warning("Mongo no es replica set, no hay change streams.")
+                    return self.sondear()
+                if e.code == CODIGO_HISTORIAL_PERDIDO:
+                    # El oplog ya no tiene el token: se vuelve a empezar con todo lo pendiente
+                    logging.warning("El token de reanudación caducó, se reprograma todo lo pendiente.")
+                    self.db[COLECCION_METADATOS].delete_one({"_id": ID_TOKEN_REANUDACION})
+                    continue
+                logging.error(f"Error en el change stream: {e}")
+            except PyMongoError as e:
+                logging.error(f"Error en el change stream: {e}")
+            self.carga_sucia = True
+            time.sleep(REINTENTO_S)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler por eventos (change streams de pedidos)")
+    parser.add_argument("--polling", action="store_true", help="No usar change streams, revisar pendientes periódicamente")
+    args = parser.parse_args()
+
+    logging.info("--- Iniciando Scheduler por eventos ---")
+    client = MongoClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        asegurar_indices(db)
+        migrar_contadores(db)
+        ServicioScheduler(db).correr(polling=args.polling)
+    except KeyboardInterrupt:
+        logging.info("Scheduler detenido.")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
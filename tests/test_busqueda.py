@@ -0,0 +1,21 @@
+import pytest
+
+from busqueda import claves_busqueda, completar_claves_busqueda, filtro_busqueda
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_completar_claves_busqueda_pedidos_viejos():
+    db = mongomock.MongoClient().produccion_db
+    # Pedidos cargados antes de las claves (el ETL ya no los reescribe) y uno que sí las trae
+    db.pedidos.insert_many([{"OP": str(150000 + i), "CLIENTE": "Cartón Álvarez"} for i in range(7)])
+    db.pedidos.insert_one({"OP": "170000", "CLIENTE": "Otro", "claves_busqueda": ["ya-estaba"]})
+
+    assert completar_claves_busqueda(db, tamano_lote=3) == 7
+    assert db.pedidos.count_documents({"claves_busqueda": {"$exists": False}}) == 0
+    assert db.pedidos.find_one({"OP": "150003"})["claves_busqueda"] == claves_busqueda("150003", "Cartón Álvarez")
+    assert db.pedidos.find_one({"OP": "170000"})["claves_busqueda"] == ["ya-estaba"]
+    assert {doc["OP"] for doc in db.pedidos.find(filtro_busqueda("carton alv"))} == {str(150000 + i) for i in range(7)}
+
+    # Idempotente: la segunda corrida no toca nada
+    assert completar_claves_busqueda(db) == 0
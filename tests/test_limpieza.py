@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from etl import (
+    SERIAL_EXCEL_MAX, SERIAL_EXCEL_MIN, convertir_entero_serie, convertir_fecha_excel, convertir_fecha_excel_serie, limpiar_op,
+    limpiar_op_serie
+)
+
+# Prueba diferencial: las versiones vectorizadas contra los limpiadores valor por valor
+
+VALORES_OP = [
+    True, False, np.nan, None, 123.0, 123, " 456 ", "", "   ", "abc", " abc ", -5, -5.9,
+    12.7, "12.7", 1e20, 2**63, "0x1",
+]
+
+VALORES_FECHA = [
+    45200, 45200.75, "45200", " 45200 ", -5, 0, True, np.nan, None, "", "  ",
+    "2025-10-01", "no es fecha", SERIAL_EXCEL_MIN, SERIAL_EXCEL_MAX,
+]
+
+
+def iguales(a, b) -> bool:
+    if a is None or b is None or (not isinstance(a, str) and pd.isna(a)) or (not isinstance(b, str) and pd.isna(b)):
+        return (a is None or pd.isna(a)) and (b is None or pd.isna(b))
+    return a == b
+
+
+def test_limpiar_op_serie_igual_a_limpiar_op():
+    esperado = [limpiar_op(v) for v in VALORES_OP]
+    resultado = limpiar_op_serie(pd.Series(VALORES_OP, dtype=object)).tolist()
+    assert resultado == esperado
+
+
+def test_limpiar_op_serie_vacios_son_none():
+    resultado = limpiar_op_serie(pd.Series([np.nan, None, "", " "], dtype=object)).tolist()
+    assert resultado == [None, None, None, None]
+
+
+def test_limpiar_op_serie_solo_booleanos():
+    assert limpiar_op_serie(pd.Series([True, False], dtype=object)).tolist() == ["1", "0"]
+
+
+def test_limpiar_op_serie_valor_por_valor():
+    # Cada valor solo en su columna (cambia el dtype que infiere to_numeric)
+    for valor in VALORES_OP:
+        assert limpiar_op_serie(pd.Series([valor], dtype=object)).tolist() == [limpiar_op(valor)], valor
+
+
+def test_convertir_fecha_excel_serie_igual_a_convertir_fecha_excel():
+    resultado = convertir_fecha_excel_serie(pd.Series(VALORES_FECHA, dtype=object)).tolist()
+    for valor, obtenido in zip(VALORES_FECHA, resultado):
+        assert iguales(obtenido, convertir_fecha_excel(valor)), valor
+
+
+def test_convertir_fecha_excel_serie_fuera_de_rango_es_nat():
+    serie = pd.Series([45200, 1000000, -1000000, "4637-11-26", "2025-10-01"], dtype=object, name="Entrega")
+    resultado = convertir_fecha_excel_serie(serie)
+    assert resultado.notna().tolist() == [True, False, False, False, True]
+    assert resultado.astype("datetime64[ns]").notna().sum() == 2
+
+
+def test_transform_con_serial_fuera_de_rango():
+    from etl import transform
+
+    maestra = pd.DataFrame({
+        "OP": [170001, 170002], "Cliente": ["A", "B"], "Tipo": ["T", "T"], "Res": ["R", "R"],
+        "Flauta": ["C", "C"], "Ancho": [10, 10], "Largo": [20, 20], "O/C": ["OC", "OC"],
+        "Ingreso": [45200, 45200], "CantPedida": [100, 100], "DIRECCIÓN DE ENTREGA": ["X", "X"],
+        "Entrega": [45230, 1000000], "M² INGRESADOS ": [3.5, 3.5],
+    })
+    plancor = pd.DataFrame({"op_plancor": ["999"], "cantidad_plancor": [1.0]})
+    terminado = pd.DataFrame({"op_terminado": ["999"], "existe_en_terminado": [True]})
+
+    df = transform(maestra, plancor, terminado)
+    # La OP con Entrega imposible se descarta como cualquier fecha vacía
+    assert df["OP"].tolist() == ["170001"]
+    assert str(df["FECHA_ENTREGA"].dtype) == "datetime64[ns]"
+
+
+def test_convertir_entero_serie_fuera_de_rango_se_recorta(caplog):
+    serie = pd.Series([12, 12.7, "7", "", None, 3e9, -3e9, float("inf"), 2**31 - 1, True], name="PIEZAS")
+
+    resultado = convertir_entero_serie(serie, "int32")
+
+    assert str(resultado.dtype) == "int32"
+    assert resultado.tolist() == [12, 12, 7, 0, 0, 2**31 - 1, -2**31, 2**31 - 1, 2**31 - 1, 1]
+    assert "PIEZAS: 3 valores fuera del rango de int32" in caplog.text
+
+
+def test_transform_con_piezas_fuera_de_rango():
+    from etl import transform
+
+    maestra = pd.DataFrame({
+        "OP": [170001, 170002], "Cliente": ["A", "B"], "Tipo": ["T", "T"], "Res": ["R", "R"],
+        "Flauta": ["C", "C"], "Ancho": [10, 10], "Largo": [20, 20], "O/C": ["OC", "OC"],
+        "Ingreso": [45200, 45200], "CantPedida": [100, 3e9], "DIRECCIÓN DE ENTREGA": ["X", "X"],
+        "Entrega": [45230, 45230], "M² INGRESADOS ": [3.5, 3.5],
+    })
+    plancor = pd.DataFrame({"op_plancor": ["170001", "170002"], "cantidad_plancor": [100.0, 100.0]})
+    terminado = pd.DataFrame({"op_terminado": ["999"], "existe_en_terminado": [True]})
+
+    df = transform(maestra, plancor, terminado).set_index("OP")
+    # 3e9 no se vuelve -2147483648 (que dejaría la OP como PROGRAMADO): sigue faltando producción
+    assert df.loc["170002", "PIEZAS"] == 2**31 - 1
+    assert df.loc["170002", "ESTATUS_EXCEL"] == "PROGRAMADO PARCIAL"
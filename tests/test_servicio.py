@@ -0,0 +1,36 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+import servicio_scheduler
+from contadores import reconciliar
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_programar_con_escritura_incompleta_relee_la_carga(monkeypatch):
+    db = mongomock.MongoClient().produccion_db
+    hoy = datetime.combine(datetime.now().date(), time.min)
+    db.pedidos.insert_many([
+        {"OP": f"n{i}", "M2": 30000.0, "ESTATUS_EXCEL": "INGRESO", "prioridad": 1, "FECHA_INGRESO": hoy,
+         "FECHA_ENTREGA": hoy + timedelta(days=30), "fecha_programacion_asignada": None}
+        for i in range(4)
+    ])
+    servicio = servicio_scheduler.ServicioScheduler(db)
+    servicio.preparar_carga()
+
+    actualizar = servicio_scheduler.actualizar_base_datos
+
+    def con_carrera(db_, actualizaciones, m2_por_op):
+        # Un usuario le pone fecha a n0 entre la lectura y la escritura del servicio
+        db.pedidos.update_one({"OP": "n0"}, {"$set": {"fecha_programacion_asignada": hoy + timedelta(days=9)}})
+        return actualizar(db_, actualizaciones, m2_por_op)
+
+    monkeypatch.setattr(servicio_scheduler, "actualizar_base_datos", con_carrera)
+
+    assert servicio.programar() == 4
+    assert servicio.carga_sucia
+    assert "n0" not in servicio.propios
+
+    servicio.preparar_carga()
+    assert reconciliar(db, reparar=False) == []
@@ -0,0 +1,61 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+import scheduler
+from scheduler import cargar_snapshot, simular_programacion
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def snapshot():
+    db = mongomock.MongoClient().produccion_db
+    hoy = datetime.combine(datetime.now().date(), time.min)
+    # Como los escribe el ETL: sin campo prioridad
+    db.pedidos.insert_many([
+        {"OP": str(170000 + i), "M2": 60000.0, "ESTATUS_EXCEL": "SIN FABRICAR",
+         "FECHA_INGRESO": hoy - timedelta(days=10 - i), "FECHA_ENTREGA": hoy + timedelta(days=15),
+         "fecha_programacion_asignada": None}
+        for i in range(6)
+    ])
+    return cargar_snapshot(db)
+
+
+def test_simulacion_prioridad_sin_campo_prioridad(snapshot):
+    assert "prioridad" not in snapshot["pedidos"].columns
+
+    base = simular_programacion(snapshot)
+    # La OP más reciente pasa al frente: mismo total, pero el reporte no truena
+    reporte = simular_programacion(snapshot, prioridades={"170005": 0})
+
+    assert sum(d["m2_utilizados"] for d in reporte) == pytest.approx(sum(d["m2_utilizados"] for d in base))
+    assert reporte[-1]["fecha"] == "Posteriores"
+
+
+def test_simulacion_con_snapshot_de_ayer(monkeypatch):
+    # Snapshot armado el viernes 23:59 y simulado el sábado: el horizonte de "hoy" ya no es el de la carga
+    viernes = datetime(2026, 10, 23, 23, 59)
+
+    class Reloj(datetime):
+        ahora = viernes
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.ahora
+
+    monkeypatch.setattr(scheduler, "datetime", Reloj)
+    db = mongomock.MongoClient().produccion_db
+    db.pedidos.insert_many([
+        {"OP": str(180000 + i), "M2": 150000.0, "ESTATUS_EXCEL": "SIN FABRICAR",
+         "FECHA_INGRESO": viernes - timedelta(days=5), "FECHA_ENTREGA": viernes + timedelta(days=60),
+         "fecha_programacion_asignada": None}
+        for i in range(scheduler.DIAS_REPORTE_FUTUROS + 3)
+    ])
+    snapshot = cargar_snapshot(db)
+
+    Reloj.ahora = viernes + timedelta(minutes=2)
+    reporte = simular_programacion(snapshot)
+
+    assert [d["fecha"] for d in reporte[:-1]] == [dia.isoformat() for dia in snapshot["dias_reporte"]]
+    assert sum(d["conteo_pedidos"] for d in reporte) == scheduler.DIAS_REPORTE_FUTUROS + 3